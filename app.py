@@ -5,8 +5,6 @@
 import streamlit as st
 import importlib
 
-from scripts.supabase_client import supabase
-
 st.set_page_config(
     page_title="Fund Management System",
     layout="wide",
@@ -83,6 +81,7 @@ with st.sidebar:
         st.session_state.clear()
 
         try:
+            from scripts.supabase_client import supabase
             supabase.auth.sign_out()
         except Exception:
             pass
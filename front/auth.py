@@ -5,9 +5,9 @@ import datetime as dt
 from datetime import date
 from sqlalchemy import text
 
-from scripts.supabase_client import supabase, supabase_admin
 from scripts.email_utils import send_reset_email
 from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND
 
 
 engine = get_engine()
@@ -65,6 +65,8 @@ def render_auth():
                 st.error("User not found")
                 st.stop()
 
+            from scripts.supabase_client import supabase_admin
+
             supabase_admin.auth.admin.update_user_by_id(
                 str(user_record["auth_user_id"]),
                 {"password": new_password}
@@ -109,7 +111,7 @@ def render_auth():
 
             with engine.connect() as conn:
                 user = conn.execute(text("""
-                    SELECT email, username, role, customer_id, display_name
+                    SELECT email, username, role, customer_id, display_name, fund
                     FROM users
                     WHERE username = :u
                 """), {"u": username}).mappings().fetchone()
@@ -118,6 +120,8 @@ def render_auth():
                 st.error("Invalid username or password")
                 st.stop()
 
+            from scripts.supabase_client import supabase
+
             res = supabase.auth.sign_in_with_password({
                 "email": user["email"],
                 "password": password
@@ -132,6 +136,7 @@ def render_auth():
             st.session_state.username = user["username"]
             st.session_state.customer_id = user["customer_id"]
             st.session_state.is_admin = user["role"] == "admin"
+            st.session_state.fund = user["fund"] or DEFAULT_FUND
 
             st.rerun()
 
@@ -171,6 +176,8 @@ def render_auth():
 
         if submitted:
 
+            from scripts.supabase_client import supabase
+
             res = supabase.auth.sign_up({
                 "email": email,
                 "password": password
@@ -282,6 +289,8 @@ def render_auth():
 
             except Exception as e:
 
+                from scripts.supabase_client import supabase_admin
+
                 supabase_admin.auth.admin.delete_user(auth_user_id)
 
                 st.error(f"Database error: {e}")
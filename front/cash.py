@@ -1,11 +1,11 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 
 from scripts.db import load_table, smart_dataframe
 
 
 def render():
+    import plotly.graph_objects as go
 
     st.header("💹Cash")
     df_tradestore = load_table("trades")
@@ -11,6 +11,8 @@ from scripts.fundshare import (
     get_latest_nav_per_unit,
     calculate_fundshare_fee
 )
+from scripts.funds import DEFAULT_FUND
+from scripts.inav import get_inav
 from scripts.information import load_investor_portfolio
 
 
@@ -19,8 +21,8 @@ from scripts.information import load_investor_portfolio
 # ==============================
 
 @st.cache_data(ttl=5)
-def load_nav():
-    return float(get_latest_nav_per_unit() or 0)
+def load_nav(fund=DEFAULT_FUND):
+    return float(get_latest_nav_per_unit(fund) or 0)
 
 
 @st.cache_data(ttl=5)
@@ -114,12 +116,20 @@ def render_investor(engine):
     current_cash = float(portfolio.get("current_cash", 0) or 0)
     available_cash = float(portfolio.get("available_cash", 0) or 0)
     current_units = float(portfolio.get("nos", 0) or 0)
-    nav_price = load_nav()
+    fund = st.session_state.get("fund", DEFAULT_FUND)
+    nav_price = load_nav(fund)
 
     if nav_price <= 0:
         st.error("NAV is not available")
         st.stop()
 
+    # preview dùng iNAV trong phiên (nếu còn hạn); lệnh vẫn khớp theo NAV chốt
+    inav = get_inav(fund).latest()
+    preview_price = nav_price
+
+    if inav and not inav["stale"] and inav["nav_per_unit"]:
+        preview_price = inav["nav_per_unit"]
+
     st.subheader("Fund Unit Transaction")
 
     c1, c2, c3, c4 = st.columns(4)
@@ -129,6 +139,14 @@ def render_investor(engine):
     c4.metric("Units Held", f"{current_units:,.0f}")
     c3.metric("Current cash", f"{current_cash:,.0f}")
 
+    if preview_price != nav_price:
+        st.caption(
+            f"Indicative NAV per unit: {preview_price:,.2f} "
+            f"(quotes as of {inav['quotes_as_of']:%H:%M:%S}, "
+            f"valid until {inav['stale_after']:%H:%M:%S}). "
+            "Previews use this estimate; orders settle at the finalized NAV."
+        )
+
     side = st.selectbox("Side", ["Buy", "Sell"])
 
     amount = 0.0
@@ -152,7 +170,7 @@ def render_investor(engine):
 
         fee = float(calculate_fundshare_fee("Buy", amount) or 0)
         net_value = amount - fee
-        units = net_value / nav_price if nav_price > 0 else 0
+        units = net_value / preview_price if preview_price > 0 else 0
 
         # ===== VALIDATION =====
         if amount <= 0:
@@ -210,10 +228,15 @@ def render_investor(engine):
             if st.button("Sell All"):
                 quantity = current_units
 
+        # lệnh khớp theo NAV chốt: phí lưu vào request tính trên nav_price
         gross_value = quantity * nav_price
         fee = float(calculate_fundshare_fee("Sell", gross_value) or 0)
         net_value = gross_value - fee
 
+        # iNAV chỉ để hiển thị ước tính
+        preview_gross = quantity * preview_price
+        preview_fee = float(calculate_fundshare_fee("Sell", preview_gross) or 0)
+
         # ===== VALIDATION =====
         if quantity <= 0:
             error = "Quantity must be greater than 0"
@@ -244,9 +267,9 @@ def render_investor(engine):
 
             c1, c2, c3 = st.columns(3)
 
-            c1.metric("Gross Value", f"{gross_value:,.0f}")
-            c2.metric("Fee", f"{fee:,.0f}")
-            c3.metric("Net Proceeds", f"{net_value:,.0f}")
+            c1.metric("Gross Value", f"{preview_gross:,.0f}")
+            c2.metric("Fee", f"{preview_fee:,.0f}")
+            c3.metric("Net Proceeds", f"{preview_gross - preview_fee:,.0f}")
 
 
     if error is not None:
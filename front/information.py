@@ -7,6 +7,7 @@ from scripts.information import (
     load_investor_portfolio
 )
 from scripts.db import smart_dataframe
+from scripts.funds import DEFAULT_FUND
 
 
 def render():
@@ -23,7 +24,9 @@ def render():
 
         st.header("Fund Information")
 
-        info = load_admin_information()
+        info = load_admin_information(
+            st.session_state.get("fund", DEFAULT_FUND)
+        )
 
         col1, col2, col3 = st.columns(3)
 
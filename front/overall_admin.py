@@ -1,33 +1,125 @@
 import streamlit as st
 import pandas as pd
-from scripts.db import load_table, smart_dataframe, update_overall_snapshot, run_nav_pipeline
+from scripts.db import (
+    load_table,
+    load_latest_snapshot,
+    smart_dataframe,
+    update_overall_snapshot,
+    run_nav_pipeline,
+    get_nav_run_status,
+    load_nav_preview_inputs,
+    preview_nav
+)
 from scripts.ui.nav_chart import render_nav_chart
-from scripts.ui.nav_service import get_nav_df
+from scripts.ui.nav_service import get_nav_cache, get_nav_df
 from scripts.db_engine import get_engine
-from sqlalchemy import text
+from scripts.nav_engine import recompute_nav_range
+from scripts.fund_units import verify_outstanding_units
+from scripts.funds import DEFAULT_FUND
+from scripts.fees import DEFAULT_FEE_RATES, accrue_fees, set_fee_rate
+from scripts.snapshots import compute_overall_snapshot, load_snapshot_series
+from sqlalchemy.exc import SQLAlchemyError
+
+# lỗi của run NAV hiển thị trên page thay vì traceback: ValueError (RAISE
+# trong pipeline), RuntimeError (step lỗi khác), lỗi DB / kết nối
+NAV_RUN_ERRORS = (ValueError, RuntimeError, SQLAlchemyError)
+
+
+def render_nav_steps(steps):
+    df_steps = pd.DataFrame(steps)
+    df_steps["share"] = df_steps["ms"] / df_steps["ms"].sum()
+    st.dataframe(
+        df_steps.rename(columns={
+            "step": "Step",
+            "rows": "Rows",
+            "ms": "Duration (ms)",
+            "share": "Share",
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+def render_failed_nav_run(engine, fund: str, error: Exception):
+    """
+    Run NAV lỗi: lỗi + bước lỗi + các bước đã chạy, đọc từ dòng FAILED
+    trong ledger nav_runs.
+    """
+    st.error(f"NAV run failed: {error}")
+
+    try:
+        failed = get_nav_run_status(engine, fund=fund)
+    except SQLAlchemyError as e:
+        st.caption(f"NAV run ledger unavailable: {e}")
+        return
+
+    if not failed or failed["status"] != "FAILED":
+        return
+
+    steps = failed["steps"] or []
+
+    st.caption(
+        f"Run {failed['run_id']} ({failed['nav_date']}) failed "
+        + (f"after step '{steps[-1]['step']}'" if steps else "before the first step")
+        + (f": {failed['error']}" if failed["error"] else "")
+    )
+
+    if steps:
+        render_nav_steps(steps)
+
+
 def render():
-    df = load_table("overall_snapshot")
-    df_nav = load_table("nav")
+    fund = st.session_state.get("fund", DEFAULT_FUND)
+    engine = get_engine()
+
+    df_port = load_table("portfolio")
+    df_nav = get_nav_df(fund)
     df_costs = load_table("costs")
+
+    # chỉ hiển thị dữ liệu của quỹ đang đăng nhập
+    df_port = df_port[df_port["fund"] == fund] if "fund" in df_port.columns else df_port
+    df_costs = df_costs[df_costs["fund"] == fund] if "fund" in df_costs.columns else df_costs
     
-    df_nav["nav_date"] = pd.to_datetime(df_nav["nav_date"])
-    df_nav = df_nav.sort_values("nav_date")
     # ---------- TABLE ----------
     st.subheader("Overall")
-    if not df.empty and "snapshot_time" in df.columns:
-        df["snapshot_time"] = pd.to_datetime(df["snapshot_time"])
-        latest_time = df["snapshot_time"].max()
-        df_ove = df[df["snapshot_time"] == latest_time]
+
+    # tính từ portfolio đã cache, không cần ghi overall_snapshot để xem
+    df_ove = compute_overall_snapshot(df_port)
+
+    if not df_ove.empty:
         smart_dataframe(
             df_ove,
             "overall_snapshot",
             width="stretch",
             hide_index=True
         )
-    if st.button("Update Overall Snapshot"):
-            update_overall_snapshot()
-            st.success("Overall snapshot updated successfully")
+
+    df_saved = load_latest_snapshot(fund)
+
+    if not df_saved.empty:
+        st.caption(
+            f"Last saved snapshot: {df_saved['snapshot_time'].max():%Y-%m-%d %H:%M:%S}"
+        )
+
+    if st.button("Save Overall Snapshot (audit)"):
+            update_overall_snapshot(fund=fund)
+            st.success("Overall snapshot saved")
             st.rerun()
+
+    with st.expander("Weight Drift"):
+
+        df_series = load_snapshot_series(engine, fund)
+
+        if df_series.empty:
+            st.info("No daily snapshot history yet.")
+        else:
+            st.line_chart(
+                df_series[df_series["attribute"] != "Total"].pivot_table(
+                    index="snapshot_time",
+                    columns="attribute",
+                    values="weight"
+                )
+            )
     st.subheader("Costs")
     df_costs["cost_date"] = pd.to_datetime(df_costs["cost_date"])
     
@@ -50,16 +142,147 @@ def render():
         hide_index=True
     )
    
-    df_nav = get_nav_df()
-    if st.button("Run NAV Daily Process"):
-        engine = get_engine()
-        logs, result, error = run_nav_pipeline(engine)
 
-        if error:
-            st.error(error)
+    run_status = get_nav_run_status(engine, fund=fund)
+
+    if run_status:
+        st.caption(
+            f"Last NAV run ({run_status['nav_date']}): {run_status['status']}"
+            f" · started {run_status['started_at']:%Y-%m-%d %H:%M:%S}"
+            + (f" · {run_status['error']}" if run_status["error"] else "")
+        )
+
+        if run_status["steps"]:
+            with st.expander("NAV run step breakdown"):
+                render_nav_steps(run_status["steps"])
+
+    c1, c2 = st.columns(2)
+
+    run_nav = c1.button("Run NAV Daily Process")
+    rerun_nav = c2.button("Re-run NAV (overwrite today)")
+
+    if run_nav or rerun_nav:
+
+        try:
+            result = run_nav_pipeline(engine, force=rerun_nav, fund=fund)
+        except NAV_RUN_ERRORS as e:
+            render_failed_nav_run(engine, fund, e)
         else:
-            st.success("NAV finalized")
-            st.rerun()
+            if result["reused"]:
+                st.info("NAV for today is already finalized; showing that run.")
+            else:
+                st.success("NAV finalized")
+                st.rerun()
+
+    if st.button("Verify Outstanding Units"):
+
+        check = verify_outstanding_units(engine, fund=fund)
+
+        if check["ok"]:
+            st.success(f"Units aggregate OK: {check['aggregate']:,.4f}")
+        else:
+            st.error(
+                f"Units aggregate drift: {check['drift']:,.4f} "
+                f"(aggregate {check['aggregate']:,.4f}, "
+                f"scan {check['scanned']:,.4f})"
+            )
+
+    with st.expander("Fee Schedule & Accrual"):
+
+        with st.form("fee_schedule_form"):
+
+            c1, c2, c3 = st.columns(3)
+
+            fee_type = c1.selectbox("Fee", list(DEFAULT_FEE_RATES))
+            fee_rate = c2.number_input(
+                "Annual rate" if fee_type == "management_fee" else "Rate",
+                min_value=0.0,
+                value=DEFAULT_FEE_RATES[fee_type],
+                step=0.0005,
+                format="%.4f"
+            )
+            fee_from = c3.date_input("Effective from")
+
+            fee_submitted = st.form_submit_button("Save rate")
+
+        if fee_submitted:
+            set_fee_rate(engine, fee_type, fee_rate, fee_from, fund=fund)
+            st.success(f"{fee_type} = {fee_rate:.4f} from {fee_from}")
+
+        if st.button("Accrue Missing Fee Days"):
+
+            accrued = accrue_fees(engine, fund=fund)
+
+            if accrued["days"]:
+                st.success(
+                    f"Accrued {accrued['days']} days "
+                    f"({accrued['start']} → {accrued['through']}, "
+                    f"{accrued['rows']} cost rows)"
+                )
+            else:
+                st.info("No missing fee days.")
+
+    with st.expander("What-if NAV Preview"):
+
+        inputs = load_nav_preview_inputs(fund=fund)
+
+        df_prices = inputs["portfolio"]
+        df_prices = df_prices[df_prices["asset_type"] != "Cash"][
+            ["ticker", "quantity", "market_price"]
+        ].reset_index(drop=True)
+
+        df_edit = st.data_editor(
+            df_prices,
+            disabled=["ticker", "quantity"],
+            hide_index=True,
+            key="nav_preview_prices"
+        )
+
+        preview = preview_nav(
+            inputs["portfolio"],
+            inputs["units"],
+            inputs["traded"],
+            price_overrides=df_edit.set_index("ticker")["market_price"].to_dict(),
+            **inputs["rates"]
+        )
+
+        c1, c2, c3, c4 = st.columns(4)
+
+        c1.metric("NAV Gross", f"{preview['nav_gross']:,.0f}")
+        c2.metric("Fees", f"{preview['total_cost']:,.0f}")
+        c3.metric("NAV Net", f"{preview['nav_net']:,.0f}")
+        c4.metric(
+            "NAV / Unit",
+            f"{preview['nav_per_unit']:,.2f}" if preview["nav_per_unit"] else "—"
+        )
+
+    with st.expander("Recompute NAV History"):
+
+        c1, c2 = st.columns(2)
+
+        start = c1.date_input("From", key="nav_recompute_start")
+        end = c2.date_input("To", key="nav_recompute_end")
+
+        if st.button("Recompute NAV Range"):
+
+            try:
+                recompute = recompute_nav_range(engine, start, end, fund)
+            except NAV_RUN_ERRORS as e:
+                st.error(f"NAV recompute failed: {e}")
+            else:
+                # NAV lịch sử đã đổi: cache chuỗi NAV phải tải lại
+                get_nav_cache(fund).invalidate()
+
+                st.success(
+                    f"Rebuilt {recompute['days']} days "
+                    f"({recompute['rows']['nav']} nav, "
+                    f"{recompute['rows']['costs']} cost rows)"
+                )
+                if recompute["skipped"]:
+                    st.warning(
+                        f"Skipped {len(recompute['skipped'])} days "
+                        "with no outstanding units"
+                    )
 
     st.subheader("NAV per Unit Over Time")
 
@@ -1,8 +1,10 @@
 import streamlit as st
-import pandas as pd
 from scripts.db import load_table, smart_dataframe
+from scripts.snapshots import compute_overall_snapshot
 from scripts.ui.nav_chart import render_nav_chart
+from scripts.ui.nav_service import get_nav_df
 from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND
 from sqlalchemy import text
 
 
@@ -20,13 +22,16 @@ def render():
         st.info(setting["intro_context"])
         st.divider()
 
-    df = load_table("overall_snapshot")
+    fund = st.session_state.get("fund", DEFAULT_FUND)
+
     df_port = load_table("portfolio")
-    df_nav = load_table("nav")
-    if not df.empty and "snapshot_time" in df.columns:
-        df["snapshot_time"] = pd.to_datetime(df["snapshot_time"])
-        latest_time = df["snapshot_time"].max()
-        df_ove = df[df["snapshot_time"] == latest_time]
+    df_nav = get_nav_df(fund)
+
+    # chỉ hiển thị dữ liệu của quỹ nhà đầu tư tham gia
+    df_port = df_port[df_port["fund"] == fund] if "fund" in df_port.columns else df_port
+
+    # snapshot tính trong bộ nhớ từ portfolio đã cache (không ghi DB)
+    df_ove = compute_overall_snapshot(df_port)
     df_nav = df_nav.sort_values("nav_date")
     # ---------- TABLE ----------
     st.subheader("Overall")
@@ -5,8 +5,58 @@ from sqlalchemy import text
 
 from scripts.db import load_table, smart_dataframe
 from scripts.db_engine import get_engine
-from scripts.pricing_yahoo import update_all_prices
+from scripts.funds import DEFAULT_FUND
 from scripts.portfolio import build_trade_record, update_portfolio
+from scripts.update_prices import read_request, read_status, request_refresh
+from scripts.quote_board import get_quote_board
+from scripts.quote_cache import session_closed_today
+from scripts.corporate_actions import (
+    ACTION_TYPES,
+    apply_corporate_actions,
+    record_corporate_action
+)
+
+
+# ======================
+# INTRADAY QUOTES (DELTA)
+# ======================
+
+@st.fragment(run_every=15)
+def render_intraday_quotes(board, df_port):
+
+    changes, version = board.changes_since(
+        st.session_state.get("quote_version", 0)
+    )
+
+    quotes = st.session_state.setdefault("intraday_quotes", {})
+
+    for q in changes:
+        quotes[q["ticker"]] = q
+
+    st.session_state.quote_version = version
+
+    if not quotes:
+        st.info("No intraday quotes yet.")
+        return
+
+    df_live = pd.DataFrame(list(quotes.values()))[
+        ["ticker", "close_price", "market_date"]
+    ]
+
+    if not df_port.empty and "quantity" in df_port.columns:
+        df_live = df_live.merge(
+            df_port[["ticker", "quantity", "buy_price"]],
+            on="ticker",
+            how="left"
+        )
+        df_live["live_value"] = df_live["quantity"] * df_live["close_price"]
+
+    st.caption(
+        f"{len(changes)} quotes changed · last poll: {board.polled_at}"
+        + (f" · {board.last_error}" if board.last_error else "")
+    )
+
+    st.dataframe(df_live, use_container_width=True, hide_index=True)
 
 
 def render():
@@ -15,11 +65,14 @@ def render():
 
     engine = get_engine()
 
+    fund = st.session_state.get("fund", DEFAULT_FUND)
+
     # ======================
     # LOAD PORTFOLIO
     # ======================
 
     df_port = load_table("portfolio")
+    df_port = df_port[df_port["fund"] == fund] if "fund" in df_port.columns else df_port
 
     smart_dataframe(
         df_port,
@@ -35,14 +88,126 @@ def render():
     # UPDATE MARKET PRICES
     # ======================
 
-    if st.button("Update Market Prices"):
+    # giá do daemon scripts.update_prices refresh; page chỉ đọc trạng thái
+    # và xếp yêu cầu, không gọi provider trong request
+    status = read_status()
+
+    if status:
+        st.caption(
+            f"Last price refresh: {status.get('finished_at', '')} "
+            f"({'ok' if status.get('ok') else status.get('error', 'failed')}) · "
+            f"{status.get('succeeded', 0)} prices, "
+            f"{len(status.get('failed') or {})} failed, "
+            f"{len(status.get('skipped') or [])} skipped"
+            + (
+                f" · backfilled {status['backfill'].get('rows', 0)} rows"
+                if isinstance(status.get("backfill"), dict) else ""
+            )
+        )
+
+        if status.get("failed"):
+            with st.expander("Failed tickers"):
+                st.write(status["failed"])
+    else:
+        st.caption("No price refresh has run yet.")
+
+    pending = read_request()
+
+    if pending:
+        st.info(
+            f"Price refresh requested at {pending.get('requested_at', '')}"
+            + (" (with backfill)" if pending.get("backfill") else "")
+            + "; waiting for the price daemon."
+        )
+
+    c1, c2 = st.columns(2)
 
-        with st.spinner("Fetching prices from Yahoo Finance..."):
-            update_all_prices(engine)
+    if c1.button("Request Price Refresh"):
+        request_refresh()
+        st.rerun()
 
-        st.success("Updated stock prices")
+    if c2.button("Request Price History Backfill"):
+        request_refresh(backfill=True)
         st.rerun()
 
+    # ======================
+    # CORPORATE ACTIONS
+    # ======================
+
+    with st.expander("Corporate Actions (split / stock dividend)"):
+
+        with st.form("corporate_action_form"):
+
+            ca_ticker = st.text_input("Ticker", key="ca_ticker").upper()
+
+            ca_type = st.selectbox("Type", ACTION_TYPES)
+
+            ca_ex_date = st.date_input("Ex-date")
+
+            ca_ratio = st.number_input(
+                "Ratio (new shares per old share)",
+                min_value=0.0001,
+                value=1.0,
+                step=0.1,
+                format="%.4f"
+            )
+
+            ca_submitted = st.form_submit_button("Record action")
+
+        if ca_submitted:
+
+            if ca_ticker == "":
+                st.error("Ticker cannot be empty")
+            else:
+                record_corporate_action(
+                    engine, ca_ticker, ca_ex_date, ca_type, ca_ratio
+                )
+                st.success(f"Recorded {ca_type} for {ca_ticker}")
+
+        if st.button("Apply Pending Corporate Actions"):
+
+            ca_rows = apply_corporate_actions(engine)
+
+            st.success(
+                f"Applied {ca_rows['actions']} actions: "
+                f"{ca_rows['price_history']} prices, "
+                f"{ca_rows['portfolio']} positions adjusted"
+            )
+
+    # ======================
+    # INTRADAY QUOTE BOARD
+    # ======================
+
+    st.subheader("Intraday Quotes")
+
+    board = get_quote_board()
+
+    c1, c2 = st.columns(2)
+
+    if board.running:
+        if c1.button("Stop Intraday Polling"):
+            board.stop()
+            st.rerun()
+    else:
+        if c1.button("Start Intraday Polling"):
+            board.start(engine)
+            st.rerun()
+
+    if c2.button(
+        "Commit End-of-Day Prices",
+        disabled=not session_closed_today(),
+        help="Available after today's ATC close (14:45)"
+    ):
+
+        rows = board.commit_end_of_day(engine)
+
+        st.success(
+            f"Committed {rows['price_history']} prices, "
+            f"{rows['portfolio']} portfolio rows"
+        )
+
+    render_intraday_quotes(board, df_port)
+
     # ======================
     # BUILD PORTFOLIO MAP
     # ======================
@@ -95,8 +260,9 @@ def render():
                         SELECT COALESCE(quantity,0)
                         FROM portfolio
                         WHERE ticker = :ticker
+                          AND fund = :fund
                     """),
-                    {"ticker": ticker}
+                    {"ticker": ticker, "fund": fund}
                 ).scalar()
             if quantity > max_qty:
                 error = (
@@ -127,11 +293,11 @@ def render():
                 conn.execute(
                     text("""
                         INSERT INTO trades
-                        (trade_date, ticker, side, quantity, price, cash_flow)
+                        (trade_date, ticker, side, quantity, price, cash_flow, fund)
                         VALUES
-                        (:trade_date, :ticker, :side, :quantity, :price, :cash_flow)
+                        (:trade_date, :ticker, :side, :quantity, :price, :cash_flow, :fund)
                     """),
-                    trade
+                    {**trade, "fund": fund}
                 )
 
             st.success("Trade executed successfully")
@@ -158,9 +324,10 @@ def render():
                 price,
                 cash_flow
             FROM trades
+            WHERE fund = :fund
             ORDER BY trade_date DESC
             LIMIT 200
-        """), conn)
+        """), conn, params={"fund": fund})
 
     # ===== DISPLAY =====
 
@@ -178,8 +345,20 @@ def render():
 
     if st.button("Update Portfolio"):
 
-        update_portfolio(engine)
+        bar = st.progress(0.0, text="Applying trades...")
 
-        st.success("Portfolio updated successfully")
+        result = update_portfolio(
+            engine,
+            fund=fund,
+            progress=lambda done, total: bar.progress(
+                min(done / total, 1.0) if total else 1.0,
+                text=f"Applied {done:,}/{total:,} trades"
+            )
+        )
+
+        st.success(
+            f"Portfolio updated successfully: {result['trades']:,} trades "
+            f"in {result['chunks']} chunk(s)"
+        )
 
         st.rerun()
\ No newline at end of file
@@ -0,0 +1,248 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# ==============================
+# CONFIG
+# ==============================
+# ratio = số cổ phiếu mới / 1 cổ phiếu cũ
+#   split 1:2        -> 2.0
+#   cổ tức CP 20%    -> 1.2
+#   gộp 5:1          -> 0.2
+ACTION_TYPES = ("split", "stock_dividend")
+
+
+# ==============================
+# 1️⃣ STORE
+# ==============================
+def ensure_corporate_actions_table(conn):
+    # DDL: chỉ gọi từ scripts.migrate
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS corporate_actions (
+            id          BIGSERIAL PRIMARY KEY,
+            ticker      TEXT NOT NULL,
+            ex_date     DATE NOT NULL,
+            action_type TEXT NOT NULL,
+            ratio       NUMERIC NOT NULL CHECK (ratio > 0),
+            applied     BOOLEAN NOT NULL DEFAULT FALSE,
+            applied_at  TIMESTAMPTZ,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (ticker, ex_date, action_type)
+        )
+    """))
+
+
+def record_corporate_action(
+    engine,
+    ticker: str,
+    ex_date: datetime.date,
+    action_type: str,
+    ratio: float
+):
+    if action_type not in ACTION_TYPES:
+        raise ValueError(f"action_type must be one of {ACTION_TYPES}")
+
+    if ratio <= 0:
+        raise ValueError("ratio must be > 0")
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO corporate_actions (ticker, ex_date, action_type, ratio)
+                VALUES (:ticker, :ex_date, :action_type, :ratio)
+                ON CONFLICT (ticker, ex_date, action_type)
+                DO UPDATE SET ratio = EXCLUDED.ratio
+                WHERE NOT corporate_actions.applied
+            """),
+            {
+                "ticker": ticker.upper().replace(".VN", ""),
+                "ex_date": ex_date,
+                "action_type": action_type,
+                "ratio": ratio,
+            }
+        )
+
+
+def load_corporate_actions(engine, applied: bool | None = None) -> pd.DataFrame:
+    with engine.connect() as conn:
+        df = pd.read_sql(
+            text("""
+                SELECT ticker, ex_date, action_type, ratio, applied
+                FROM corporate_actions
+                WHERE CAST(:applied AS BOOLEAN) IS NULL
+                   OR applied = CAST(:applied AS BOOLEAN)
+                ORDER BY ticker, ex_date
+            """),
+            conn,
+            params={"applied": applied}
+        )
+
+    df["ratio"] = df["ratio"].astype(float)
+    df["ex_date"] = pd.to_datetime(df["ex_date"])
+    return df
+
+
+# ==============================
+# 2️⃣ ADJUST (PANDAS, IN-MEMORY)
+# ==============================
+def adjust_prices_frame(prices: pd.DataFrame, actions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Điều chỉnh close_price theo corporate action, vector hoá.
+    prices: cột ticker, market_date, close_price
+    actions: cột ticker, ex_date, ratio
+
+    Giá ngày trước ex_date chia cho tích ratio của mọi action có
+    ex_date > market_date (cùng mã).
+    """
+    if prices.empty or actions.empty:
+        return prices
+
+    out = prices.copy()
+    dates = pd.to_datetime(out["market_date"])
+
+    factor = pd.Series(1.0, index=out.index)
+
+    for ticker, acts in actions.groupby("ticker"):
+        mask = out["ticker"] == ticker
+        if not mask.any():
+            continue
+
+        # tích ratio của các action xảy ra sau mỗi ngày giá
+        acts = acts.sort_values("ex_date")
+        ex_dates = acts["ex_date"].to_numpy()
+        cum_after = acts["ratio"].to_numpy()[::-1].cumprod()[::-1]
+
+        pos = ex_dates.searchsorted(dates[mask].to_numpy(), side="right")
+
+        factor[mask] = np.append(cum_after, 1.0)[pos]
+
+    out["close_price"] = out["close_price"] / factor
+    return out
+
+
+# ==============================
+# 3️⃣ APPLY (SET-BASED, DB)
+# ==============================
+def apply_corporate_actions(engine, as_of: datetime.date | None = None) -> dict:
+    """
+    Áp dụng mọi action chưa applied có ex_date <= as_of trong 1 transaction,
+    số statement cố định:
+      - price_history: giá trước ex_date chia tích ratio
+      - portfolio: quantity nhân, buy_price chia; market_price chia nếu
+        ngày thị trường của giá (theo price_history) trước ex_date
+      - đánh dấu applied
+    """
+    as_of = as_of or datetime.date.today()
+    rows = {"price_history": 0, "portfolio": 0, "actions": 0}
+
+    with engine.begin() as conn:
+        # khoá các action để 2 lần chạy đồng thời không áp dụng 2 lần
+        ids = [
+            r[0] for r in conn.execute(
+                text("""
+                    SELECT id
+                    FROM corporate_actions
+                    WHERE NOT applied
+                      AND ex_date <= :as_of
+                    FOR UPDATE SKIP LOCKED
+                """),
+                {"as_of": as_of}
+            )
+        ]
+
+        if not ids:
+            return rows
+
+        params = {"ids": ids}
+
+        # portfolio trước price_history: ngày thị trường của market_price
+        # được dò theo giá chưa điều chỉnh trong price_history
+        result = conn.execute(text("""
+            WITH acts AS (
+                SELECT ticker, ex_date, ratio
+                FROM corporate_actions
+                WHERE id = ANY(:ids)
+            ),
+
+            -- ngày thị trường của market_price (price_date của portfolio là
+            -- ngày hệ thống lúc refresh, không phải ngày của giá)
+            pos AS (
+                SELECT
+                    p.ticker,
+                    p.fund,
+                    COALESCE(
+                        (
+                            SELECT MAX(ph.price_date)
+                            FROM price_history ph
+                            WHERE ph.ticker = UPPER(p.ticker)
+                              AND ph.price_date <= p.price_date
+                              AND ph.close_price = p.market_price
+                        ),
+                        p.price_date
+                    ) AS market_date
+                FROM portfolio p
+                WHERE p.asset_type = 'Stock'
+                  AND UPPER(p.ticker) IN (SELECT ticker FROM acts)
+            ),
+
+            f AS (
+                SELECT
+                    pos.ticker,
+                    pos.fund,
+                    EXP(SUM(LN(a.ratio))) AS factor,
+                    -- chỉ các action có ex_date sau ngày của giá
+                    EXP(COALESCE(
+                        SUM(LN(a.ratio)) FILTER (WHERE pos.market_date < a.ex_date),
+                        0
+                    )) AS price_factor
+                FROM pos
+                JOIN acts a
+                  ON a.ticker = UPPER(pos.ticker)
+                GROUP BY pos.ticker, pos.fund
+            )
+
+            UPDATE portfolio p
+            SET
+                quantity     = p.quantity * f.factor,
+                buy_price    = p.buy_price / f.factor,
+                market_price = p.market_price / f.price_factor,
+                net_value    = p.quantity * f.factor * p.market_price / f.price_factor
+            FROM f
+            WHERE p.ticker = f.ticker
+              AND p.fund = f.fund
+              AND p.asset_type = 'Stock'
+        """), params)
+        rows["portfolio"] = result.rowcount
+
+        result = conn.execute(text("""
+            WITH f AS (
+                SELECT
+                    ph.ticker,
+                    ph.price_date,
+                    EXP(SUM(LN(ca.ratio))) AS factor
+                FROM price_history ph
+                JOIN corporate_actions ca
+                  ON ca.ticker = ph.ticker
+                 AND ph.price_date < ca.ex_date
+                WHERE ca.id = ANY(:ids)
+                GROUP BY ph.ticker, ph.price_date
+            )
+            UPDATE price_history ph
+            SET close_price = ph.close_price / f.factor
+            FROM f
+            WHERE ph.ticker = f.ticker
+              AND ph.price_date = f.price_date
+        """), params)
+        rows["price_history"] = result.rowcount
+
+        result = conn.execute(text("""
+            UPDATE corporate_actions
+            SET applied = TRUE,
+                applied_at = now()
+            WHERE id = ANY(:ids)
+        """), params)
+        rows["actions"] = result.rowcount
+
+    return rows
@@ -1,10 +1,24 @@
+import json
+import time
+import uuid
 import pandas as pd
-import os
 import streamlit as st
 from sqlalchemy import text
 from datetime import date
 from scripts.db_engine import get_engine
-from scripts.pricing_yahoo import get_close_price
+from scripts.fund_units import get_outstanding_units
+from scripts.funds import DEFAULT_FUND
+from scripts.fees import (
+    accrue_fees,
+    fee_rates_for_dates,
+    load_fee_schedule
+)
+from scripts.nav_engine import (
+    MANAGEMENT_FEE_RATE,
+    NAV_FUND_LOCK_KEY,
+    NAV_LOCK_NAMESPACE,
+    TRANSACTION_FEE_RATE
+)
 # SECURITY: ALLOWED TABLES
 # ======================
 ALLOWED_TABLES = {
@@ -155,6 +169,31 @@ def load_table(table_name: str) -> pd.DataFrame:
     return df
 
 
+@st.cache_data(ttl=5)
+def load_latest_snapshot(fund: str = DEFAULT_FUND) -> pd.DataFrame:
+    """
+    Bộ overall snapshot hiện tại của quỹ (view overall_snapshot_latest).
+    """
+    engine = get_engine()
+
+    with engine.connect() as conn:
+        df = pd.read_sql(
+            text("""
+                SELECT *
+                FROM overall_snapshot_latest
+                WHERE fund = :fund
+                ORDER BY attribute = 'Total' DESC, attribute = 'Cash', attribute
+            """),
+            conn,
+            params={"fund": fund}
+        )
+
+    for col in ("initial_investment", "market_value", "weight", "weight_obj", "profit", "interest"):
+        df[col] = df[col].astype(float)
+
+    return df
+
+
 # ======================
 from decimal import Decimal
 def smart_dataframe(df, table_name, width=None, hide_index=True):
@@ -202,389 +241,735 @@ def write_table(
     )
 # ======================
 # UPDATE OVERALL SNAPSHOT
-def update_overall_snapshot():
-
-    engine = get_engine()
+def update_overall_snapshot(engine=None, fund: str = DEFAULT_FUND):
+    """
+    Snapshot tổng quan (Total / loại tài sản / Cash) của 1 quỹ, ghi thêm
+    (append-only) vào overall_snapshot_history rồi trỏ head của quỹ tới
+    bộ mới; kèm retention intraday / daily (scripts.snapshots).
+    """
+    engine = engine or get_engine()
 
+    # 1 lượt quét portfolio: GROUPING SETS cho dòng từng loại + dòng Total,
+    # weight chia cho Total qua window
     sql = """
 
-    -- DELETE snapshot today only
-    DELETE FROM overall_snapshot;
-
-    -- TOTAL
-    INSERT INTO overall_snapshot (
+    INSERT INTO overall_snapshot_history (
         attribute,
         initial_investment,
         market_value,
         profit,
         interest,
         weight,
-        snapshot_time
+        snapshot_time,
+        fund
     )
-    SELECT
-        'Total',
-
-        SUM(
-            CASE
-                WHEN asset_type = 'Cash'
-                THEN net_value
-                ELSE buy_price * quantity
-            END
-        ),
-
-        SUM(
-            CASE
-                WHEN asset_type = 'Cash'
-                THEN net_value
-                ELSE market_price * quantity
-            END
-        ),
-
-        SUM(
-            CASE
-                WHEN asset_type = 'Cash'
-                THEN 0
-                ELSE (market_price - buy_price) * quantity
-            END
-        ),
-
-        (
+    WITH g AS (
+        SELECT
+            GROUPING(asset_type) = 1 AS is_total,
+            asset_type,
+
             SUM(
                 CASE
                     WHEN asset_type = 'Cash'
                     THEN net_value
-                    ELSE market_price * quantity
+                    ELSE buy_price * quantity
                 END
-            )
-            /
-            NULLIF(
-                SUM(
-                    CASE
-                        WHEN asset_type = 'Cash'
-                        THEN net_value
-                        ELSE buy_price * quantity
-                    END
-                ),
-                0
-            )
-        ) - 1,
-
-        1.0,
-        NOW()
-
-    FROM portfolio;
-
-
-
-    -- STOCK / BOND / FUND SHARE
-    INSERT INTO overall_snapshot (
-        attribute,
-        initial_investment,
-        market_value,
-        profit,
-        interest,
-        weight,
-        snapshot_time
-    )
-    SELECT
-        asset_type,
-
-        SUM(buy_price * quantity),
+            ) AS initial_investment,
 
-        SUM(market_price * quantity),
-
-        SUM(market_price * quantity) - SUM(buy_price * quantity),
-
-        (
-            SUM(market_price * quantity)
-            /
-            NULLIF(SUM(buy_price * quantity),0)
-        ) - 1,
-
-        SUM(market_price * quantity)
-        /
-        (
-            SELECT SUM(
+            SUM(
                 CASE
                     WHEN asset_type = 'Cash'
                     THEN net_value
                     ELSE market_price * quantity
                 END
-            )
-            FROM portfolio
-        ),
-
-        NOW()
-
-    FROM portfolio
-    WHERE asset_type IN ('Stock','Bond','Fund share')
-    GROUP BY asset_type;
-
+            ) AS market_value,
 
+            SUM(
+                CASE
+                    WHEN asset_type = 'Cash'
+                    THEN 0
+                    ELSE (market_price - buy_price) * quantity
+                END
+            ) AS profit
 
-    -- CASH
-    INSERT INTO overall_snapshot (
-        attribute,
-        initial_investment,
-        market_value,
-        profit,
-        interest,
-        weight,
-        snapshot_time
+        FROM portfolio
+        WHERE fund = :fund
+        GROUP BY GROUPING SETS ((asset_type), ())
     )
     SELECT
-        'Cash',
+        CASE WHEN is_total THEN 'Total' ELSE asset_type END,
 
-        SUM(net_value),
+        initial_investment,
 
-        SUM(net_value),
+        market_value,
 
-        0,
+        profit,
 
-        0,
+        CASE
+            WHEN NOT is_total AND asset_type = 'Cash'
+            THEN 0
+            ELSE market_value / NULLIF(initial_investment, 0) - 1
+        END,
+
+        CASE
+            WHEN is_total
+            THEN 1.0
+            ELSE market_value / NULLIF(
+                MAX(market_value) FILTER (WHERE is_total) OVER (),
+                0
+            )
+        END,
 
-        SUM(net_value)
-        /
-        NULLIF(
-            (
-                SELECT SUM(
-                    CASE
-                        WHEN asset_type='Cash'
-                        THEN net_value
-                        ELSE market_price * quantity
-                    END
-                )
-                FROM portfolio
-            ),
-            0
-        ),
+        NOW(),
+        :fund
 
-        NOW()
+    FROM g
+    WHERE is_total
+       OR asset_type IN ('Stock','Bond','Fund share','Cash')
+    ORDER BY
+        is_total DESC,
+        asset_type = 'Cash',
+        asset_type;
 
-    FROM portfolio
-    WHERE asset_type='Cash';
+    -- head -> bộ snapshot vừa ghi (NOW() cố định trong transaction)
+    INSERT INTO overall_snapshot_head (fund, snapshot_time)
+    VALUES (:fund, NOW())
+    ON CONFLICT (fund)
+    DO UPDATE SET snapshot_time = EXCLUDED.snapshot_time;
 
     """
 
+    # chỉ INSERT: partition + retention chạy trong bảo trì (scripts.snapshots)
     with engine.begin() as conn:
-        conn.execute(text(sql))
+        conn.execute(text(sql), {"fund": fund})
 
-def update_costs(engine):
-    with engine.begin() as conn:
-        conn.execute(text("""
-            DELETE FROM costs WHER cost_date=:d"""))
-        # ===== MANAGEMENT FEE (NAV latest) =====
-        conn.execute(
-            text("""
-                INSERT INTO costs (
-                    cost_date, cost_type, cost, cost_category, rate
-                )
-                SELECT
-                    n.nav_date,
-                    'management_fee',
-                    n.nav_total * 0.0015 / 365,
-                    'Management',
-                    0.0015
-                FROM nav n
-                WHERE n.nav_date = (
-                    SELECT MAX(nav_date) FROM nav
-                )
-                AND NOT EXISTS (
-                    SELECT 1
-                    FROM costs c
-                    WHERE c.cost_date = n.nav_date
-                      AND c.cost_type = 'management_fee'
-                )
-            """)
+def update_costs(engine, fund: str = DEFAULT_FUND):
+    """
+    Ghi phí cho mọi ngày còn thiếu tới hôm qua (xem scripts.fees).
+    """
+    return accrue_fees(engine, fund=fund)
+
+# ======================
+# NAV PIPELINE (SERVER-SIDE, 1 ROUND TRIP)
+# ======================
+NAV_PIPELINE_FUNCTION = """
+-- Ghi 1 bước vào log: tên, số dòng, thời gian (ms) kể từ p_t0
+CREATE OR REPLACE FUNCTION fn_nav_step(
+    p_steps JSONB, p_step TEXT, p_rows BIGINT, p_t0 TIMESTAMPTZ
+)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+    SELECT p_steps || jsonb_build_array(jsonb_build_object(
+        'step', p_step,
+        'rows', p_rows,
+        'ms', round(extract(epoch FROM clock_timestamp() - p_t0)::numeric * 1000, 3)
+    ))
+$$;
+
+DROP FUNCTION IF EXISTS fn_run_nav_pipeline(DATE);
+
+CREATE OR REPLACE FUNCTION fn_run_nav_pipeline(p_date DATE, p_fund TEXT)
+RETURNS TABLE (
+    nav_gross    NUMERIC,
+    total_cost   NUMERIC,
+    nav_net      NUMERIC,
+    units        NUMERIC,
+    nav_per_unit NUMERIC,
+    steps        JSONB
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_gross NUMERIC;
+    v_cost  NUMERIC;
+    v_units NUMERIC;
+    v_mgmt_rate NUMERIC := fn_fee_rate(p_fund, 'management_fee', p_date);
+    v_txn_rate  NUMERIC := fn_fee_rate(p_fund, 'transaction_fee', p_date);
+    v_rows  BIGINT;
+    v_t0    TIMESTAMPTZ;
+    v_steps JSONB := '[]'::jsonb;
+    v_msg   TEXT;
+    v_state TEXT;
+BEGIN
+  BEGIN
+    IF v_mgmt_rate IS NULL OR v_txn_rate IS NULL THEN
+        RAISE EXCEPTION 'No fee rate in fee_schedule for %', p_date;
+    END IF;
+
+    -- DELETE TODAY NAV / COST (của quỹ)
+    v_t0 := clock_timestamp();
+    DELETE FROM nav n WHERE n.nav_date = p_date AND n.fund = p_fund;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    v_steps := fn_nav_step(v_steps, 'delete_nav', v_rows, v_t0);
+
+    v_t0 := clock_timestamp();
+    DELETE FROM costs c WHERE c.cost_date = p_date AND c.fund = p_fund;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    v_steps := fn_nav_step(v_steps, 'delete_costs', v_rows, v_t0);
+
+    -- NAV GROSS
+    v_t0 := clock_timestamp();
+    SELECT COALESCE(SUM(
+        CASE
+            WHEN p.asset_type = 'Cash'
+            THEN p.net_value
+            ELSE p.quantity * p.market_price
+        END
+    ), 0), COUNT(*)
+    INTO v_gross, v_rows
+    FROM portfolio p
+    WHERE p.fund = p_fund;
+    v_steps := fn_nav_step(v_steps, 'nav_gross', v_rows, v_t0);
+
+    -- MANAGEMENT FEE + TRANSACTION FEE (rate theo fee_schedule)
+    v_t0 := clock_timestamp();
+    INSERT INTO costs (cost_date, cost_type, cost, cost_category, rate, fund)
+    VALUES (p_date, 'management_fee', v_gross * v_mgmt_rate / 365, 'Management', v_mgmt_rate, p_fund);
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    v_steps := fn_nav_step(v_steps, 'management_fee', v_rows, v_t0);
+
+    v_t0 := clock_timestamp();
+    INSERT INTO costs (cost_date, cost_type, cost, cost_category, rate, fund)
+    SELECT
+        p_date,
+        'transaction_fee',
+        COALESCE(SUM(ABS(f.cash_flow) * v_txn_rate), 0),
+        'Trading',
+        v_txn_rate,
+        p_fund
+    FROM fundshare_trades f
+    WHERE CAST(f.trade_date AS DATE) = p_date
+      AND f.status = 'SUCCESS'
+      AND f.fund = p_fund;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    v_steps := fn_nav_step(v_steps, 'transaction_fee', v_rows, v_t0);
+
+    -- TOTAL COST
+    v_t0 := clock_timestamp();
+    SELECT COALESCE(SUM(c.cost), 0), COUNT(*)
+    INTO v_cost, v_rows
+    FROM costs c
+    WHERE c.cost_date = p_date
+      AND c.fund = p_fund;
+    v_steps := fn_nav_step(v_steps, 'total_cost', v_rows, v_t0);
+
+    -- CURRENT UNITS (aggregate fund_units)
+    v_t0 := clock_timestamp();
+    SELECT fu.units INTO v_units FROM fund_units fu WHERE fu.fund = p_fund;
+    v_steps := fn_nav_step(v_steps, 'units', 1, v_t0);
+
+    IF COALESCE(v_units, 0) <= 0 THEN
+        RAISE EXCEPTION 'Outstanding units <= 0';
+    END IF;
+
+    -- INSERT NAV
+    v_t0 := clock_timestamp();
+    INSERT INTO nav (nav_date, nav_total, current_units, nav_per_unit, fund)
+    VALUES (p_date, v_gross - v_cost, v_units, (v_gross - v_cost) / v_units, p_fund);
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    v_steps := fn_nav_step(v_steps, 'insert_nav', v_rows, v_t0);
+
+    RETURN QUERY
+    SELECT v_gross, v_cost, v_gross - v_cost, v_units,
+           (v_gross - v_cost) / v_units, v_steps;
+  EXCEPTION WHEN OTHERS THEN
+    -- giữ nguyên lỗi, kèm các bước đã chạy (DETAIL) cho ledger FAILED
+    GET STACKED DIAGNOSTICS v_msg = MESSAGE_TEXT, v_state = RETURNED_SQLSTATE;
+    RAISE EXCEPTION USING
+        ERRCODE = v_state,
+        MESSAGE = v_msg,
+        DETAIL = v_steps::text;
+  END;
+END;
+$$;
+"""
+
+NAV_RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS nav_runs (
+    run_id      UUID PRIMARY KEY,
+    nav_date    DATE NOT NULL,
+    status      TEXT NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ,
+    result      JSONB,
+    steps       JSONB,
+    error       TEXT
+);
+ALTER TABLE nav_runs ADD COLUMN IF NOT EXISTS steps JSONB;
+ALTER TABLE nav_runs
+    ADD COLUMN IF NOT EXISTS fund TEXT NOT NULL DEFAULT '{default_fund}';
+CREATE INDEX IF NOT EXISTS nav_runs_date_idx
+    ON nav_runs (nav_date, started_at DESC);
+""".format(default_fund=DEFAULT_FUND)
+
+# thời điểm ghi của từng dòng nav + tombstone ngày bị xoá: cache chuỗi NAV
+# (scripts.ui.nav_service) đọc delta theo 2 mốc này, bắt được cả dòng ghi
+# lại / xoá ở ngày cũ
+NAV_UPDATED_AT_DDL = """
+ALTER TABLE nav
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS nav_fund_updated_idx ON nav (fund, updated_at);
+
+CREATE OR REPLACE FUNCTION fn_nav_touch()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS nav_touch ON nav;
+CREATE TRIGGER nav_touch
+    BEFORE INSERT OR UPDATE ON nav
+    FOR EACH ROW EXECUTE FUNCTION fn_nav_touch();
+
+-- ngày NAV bị xoá (hoặc dời sang ngày / quỹ khác): 1 dòng / quỹ / ngày
+CREATE TABLE IF NOT EXISTS nav_tombstones (
+    fund       TEXT NOT NULL,
+    nav_date   DATE NOT NULL,
+    deleted_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (fund, nav_date)
+);
+CREATE INDEX IF NOT EXISTS nav_tombstones_deleted_idx
+    ON nav_tombstones (fund, deleted_at);
+
+CREATE OR REPLACE FUNCTION fn_nav_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'DELETE'
+       OR (OLD.fund, OLD.nav_date) IS DISTINCT FROM (NEW.fund, NEW.nav_date) THEN
+        INSERT INTO nav_tombstones (fund, nav_date, deleted_at)
+        VALUES (OLD.fund, OLD.nav_date, clock_timestamp())
+        ON CONFLICT (fund, nav_date)
+        DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS nav_tombstone ON nav;
+CREATE TRIGGER nav_tombstone
+    AFTER DELETE OR UPDATE OF fund, nav_date ON nav
+    FOR EACH ROW EXECUTE FUNCTION fn_nav_tombstone();
+"""
+
+# wrapper của 1 run: lock, ledger, catch-up phí, pipeline, ghi kết quả
+# trong cùng 1 lời gọi / 1 transaction / 1 kết nối
+NAV_RUN_FUNCTION = """
+-- kiểu trả về đổi (thêm status / error) -> phải drop bản cũ
+DROP FUNCTION IF EXISTS fn_run_nav(DATE, TEXT, BOOLEAN, UUID);
+
+CREATE OR REPLACE FUNCTION fn_run_nav(
+    p_date DATE, p_fund TEXT, p_force BOOLEAN, p_run_id UUID
+)
+RETURNS TABLE (
+    run_id     UUID,
+    status     TEXT,
+    result     JSONB,
+    steps      JSONB,
+    error      TEXT,
+    error_code TEXT,
+    reused     BOOLEAN
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    -- cùng khoá với bản Python cũ: (hashtext('4242:<fund>'), date.toordinal())
+    v_ns    INTEGER := hashtext('{ns}:' || p_fund);
+    v_key   INTEGER := p_date - DATE '0001-01-01' + 1;
+    v_force BOOLEAN := p_force;
+    v_t0    TIMESTAMPTZ := clock_timestamp();
+    v_steps JSONB := '[]'::jsonb;
+    v_rows  BIGINT;
+    v_done  RECORD;
+    v_res   RECORD;
+    v_msg    TEXT;
+    v_state  TEXT;
+    v_detail TEXT;
+BEGIN
+    -- khoá chung cả quỹ: chờ recompute_nav_range (giữ khoá riêng) xong
+    PERFORM pg_advisory_xact_lock_shared(v_ns, {fund_key});
+
+    -- chỉ 1 run / quỹ / ngày; caller đến sau chờ rồi dùng lại kết quả
+    IF NOT pg_try_advisory_xact_lock(v_ns, v_key) THEN
+        PERFORM pg_advisory_xact_lock(v_ns, v_key);
+        v_force := FALSE;
+    END IF;
+    v_steps := fn_nav_step(v_steps, 'acquire_lock', NULL, v_t0);
+
+    IF NOT v_force THEN
+        v_t0 := clock_timestamp();
+        SELECT n.run_id, n.result, n.steps
+        INTO v_done
+        FROM nav_runs n
+        WHERE n.nav_date = p_date
+          AND n.fund = p_fund
+          AND n.status = 'SUCCESS'
+        ORDER BY n.started_at DESC
+        LIMIT 1;
+
+        IF FOUND THEN
+            RETURN QUERY
+            SELECT v_done.run_id, 'SUCCESS', v_done.result,
+                   COALESCE(v_done.steps, '[]'::jsonb), NULL, NULL, TRUE;
+            RETURN;
+        END IF;
+        v_steps := fn_nav_step(v_steps, 'check_ledger', 0, v_t0);
+    END IF;
+
+    BEGIN
+        -- catch-up phí các ngày bị bỏ sót trước p_date
+        v_t0 := clock_timestamp();
+        SELECT a.rows_inserted INTO v_rows
+        FROM fn_accrue_fee_gaps(p_fund, p_date - 1) a;
+        v_steps := fn_nav_step(v_steps, 'accrue_fees', v_rows, v_t0);
+
+        SELECT * INTO v_res FROM fn_run_nav_pipeline(p_date, p_fund);
+        v_steps := v_steps || v_res.steps;
+    EXCEPTION WHEN OTHERS THEN
+        -- mọi ghi của run đã rollback (subtransaction); ledger FAILED vẫn
+        -- được commit, kèm các bước đã chạy tới lúc lỗi
+        GET STACKED DIAGNOSTICS
+            v_msg = MESSAGE_TEXT,
+            v_state = RETURNED_SQLSTATE,
+            v_detail = PG_EXCEPTION_DETAIL;
+
+        IF v_detail LIKE '[%' THEN
+            v_steps := v_steps || CAST(v_detail AS JSONB);
+        END IF;
+
+        INSERT INTO nav_runs (
+            run_id, nav_date, status, finished_at, steps, error, fund
         )
+        VALUES (
+            p_run_id, p_date, 'FAILED', clock_timestamp(),
+            v_steps, v_msg, p_fund
+        );
+
+        RETURN QUERY
+        SELECT p_run_id, 'FAILED', NULL::jsonb, v_steps, v_msg, v_state, FALSE;
+        RETURN;
+    END;
+
+    INSERT INTO nav_runs (
+        run_id, nav_date, status, finished_at, result, steps, fund
+    )
+    VALUES (
+        p_run_id, p_date, 'SUCCESS', clock_timestamp(),
+        to_jsonb(v_res) - 'steps', v_steps, p_fund
+    );
 
-        # ===== TRANSACTION FEE (TODAY) =====
+    RETURN QUERY
+    SELECT p_run_id, 'SUCCESS', to_jsonb(v_res) - 'steps', v_steps,
+           NULL, NULL, FALSE;
+END;
+$$;
+""".format(ns=NAV_LOCK_NAMESPACE, fund_key=NAV_FUND_LOCK_KEY)
+
+
+def install_nav_pipeline(conn):
+    """
+    Tạo / cập nhật fn_run_nav_pipeline + ledger nav_runs + updated_at của
+    nav (DDL: chỉ gọi từ scripts.migrate, sau fund_units và fee_schedule).
+    """
+    conn.execute(text(NAV_RUNS_TABLE))
+    conn.execute(text(NAV_UPDATED_AT_DDL))
+    conn.execute(text(NAV_PIPELINE_FUNCTION))
+    conn.execute(text(NAV_RUN_FUNCTION))
+
+
+def _mark_nav_run(
+    engine,
+    run_id: str,
+    nav_date: date,
+    status: str,
+    error: str | None = None,
+    fund: str = DEFAULT_FUND,
+    steps: list | None = None
+):
+    # ghi ledger trên kết nối riêng, commit ngay để session khác thấy
+    with engine.begin() as conn:
         conn.execute(
             text("""
-                INSERT INTO costs (
-                    cost_date, cost_type, cost, cost_category, rate
+                INSERT INTO nav_runs (run_id, nav_date, status, error, fund, steps)
+                VALUES (
+                    CAST(:rid AS UUID), :d, :status, :error, :fund,
+                    CAST(:steps AS JSONB)
                 )
-                SELECT
-                    :d,
-                    'transaction_fee',
-                    COALESCE(SUM(ABS(cash_flow) * 0.0015), 0),
-                    'Trading',
-                    0.0015
-                FROM fundshare_trades
-                WHERE trade_date = :d
+                ON CONFLICT (run_id)
+                DO UPDATE SET
+                    status = EXCLUDED.status,
+                    error = EXCLUDED.error,
+                    steps = COALESCE(EXCLUDED.steps, nav_runs.steps),
+                    finished_at = CASE
+                        WHEN EXCLUDED.status = 'RUNNING' THEN NULL
+                        ELSE now()
+                    END
             """),
-            {"d": date.today()}
+            {
+                "rid": run_id,
+                "d": nav_date,
+                "status": status,
+                "error": error,
+                "fund": fund,
+                "steps": json.dumps(steps) if steps is not None else None
+            }
         )
 
-def run_nav_pipeline(engine):
 
-    with engine.begin() as conn:
+def run_nav_pipeline(
+    engine,
+    nav_date: date | None = None,
+    force: bool = False,
+    fund: str = DEFAULT_FUND
+):
+    """
+    Chạy NAV daily của 1 quỹ bằng 1 lời gọi fn_run_nav (1 round trip,
+    1 kết nối), an toàn khi nhiều admin bấm cùng lúc:
+      - advisory lock theo quỹ + ngày: chỉ 1 run / quỹ / ngày tại 1 thời điểm
+        (các quỹ khác nhau chạy song song được)
+      - caller đến sau chờ run đang chạy rồi dùng lại kết quả của nó
+      - ngày đã có run SUCCESS thì trả kết quả cũ, trừ khi force=True
+      - phí của các ngày bị bỏ sót trước nav_date được accrue bù
+    Run được ghi vào ledger nav_runs (SUCCESS / FAILED) trong cùng
+    transaction, kèm log các bước (cả khi lỗi).
+    """
+    nav_date = nav_date or date.today()
+    run_id = str(uuid.uuid4())
+    t0 = time.perf_counter()
+
+    try:
+        with engine.begin() as conn:
+            row = conn.execute(
+                text("""
+                    SELECT *
+                    FROM fn_run_nav(:d, :fund, :force, CAST(:rid AS UUID))
+                """),
+                {"d": nav_date, "fund": fund, "force": force, "rid": run_id}
+            ).mappings().one()
+
+    except Exception as e:
+        # lỗi ngoài function (kết nối, timeout): ghi FAILED từ phía Python
+        orig = getattr(e, "orig", e)
+        steps = [{
+            "step": "call_fn_run_nav",
+            "rows": None,
+            "ms": round((time.perf_counter() - t0) * 1000, 3),
+        }]
+        _mark_nav_run(engine, run_id, nav_date, "FAILED", str(orig), fund, steps)
+        raise
+
+    if row["status"] == "FAILED":
+        # RAISE EXCEPTION trong function -> ValueError như bản Python cũ
+        if row["error_code"] == "P0001":
+            raise ValueError(row["error"])
+        raise RuntimeError(f"NAV run failed ({row['error_code']}): {row['error']}")
+
+    return {
+        **row["result"],
+        "steps": list(row["steps"]),
+        "run_id": str(row["run_id"]),
+        "reused": row["reused"]
+    }
+
+
+def get_nav_run_status(
+    engine,
+    nav_date: date | None = None,
+    fund: str = DEFAULT_FUND
+) -> dict | None:
+    """
+    Run gần nhất của quỹ trong ledger (của nav_date nếu có).
+    """
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("""
+                SELECT run_id, nav_date, status, started_at,
+                       finished_at, result, steps, error
+                FROM nav_runs
+                WHERE fund = :fund
+                  AND (
+                      CAST(:d AS DATE) IS NULL
+                      OR nav_date = CAST(:d AS DATE)
+                  )
+                ORDER BY started_at DESC
+                LIMIT 1
+            """),
+            {"d": nav_date, "fund": fund}
+        ).mappings().fetchone()
 
-        today = date.today()
+    return dict(row) if row else None
 
-        # =========================
-        # DELETE TODAY NAV
-        # =========================
 
-        conn.execute(text("""
-            DELETE FROM nav
-            WHERE nav_date = :d
-        """), {"d": today})
+def benchmark_nav_pipeline(
+    engine,
+    runs: int = 5,
+    nav_date: date | None = None,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Đo latency end-to-end của run_nav_pipeline (ghi lại NAV ngày nav_date,
+    idempotent).
+    """
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        run_nav_pipeline(engine, nav_date, force=True, fund=fund)
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    return {
+        "runs": runs,
+        "mean_ms": sum(timings) / runs,
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+    }
 
 
-        # =========================
-        # NAV GROSS
-        # =========================
+# ======================
+# WHAT-IF NAV PREVIEW (IN-MEMORY, KHÔNG GHI DB)
+# ======================
+def read_nav_preview_inputs(
+    engine,
+    nav_date: date | None = None,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Đầu vào cho preview_nav của 1 quỹ: portfolio, units (aggregate), giá trị
+    giao dịch CCQ trong ngày, rate phí hiệu lực. Chỉ đọc, không cache.
 
-        nav_gross = conn.execute(text("""
-            SELECT
-                COALESCE(SUM(
-                    CASE
-                        WHEN asset_type = 'Cash'
-                        THEN net_value
-                        ELSE quantity * market_price
-                    END
-                ),0)
-            FROM portfolio
-        """)).scalar()
+    Không chạy DDL / seed: quỹ chưa có dòng fund_units thì units = 0 (seed
+    nằm trong python -m scripts.migrate).
+    """
+    nav_date = nav_date or date.today()
 
+    # kết nối đọc thuần, không mở transaction ghi
+    with engine.connect() as conn:
+        portfolio = pd.read_sql(
+            text("""
+                SELECT ticker, asset_type, quantity, market_price, net_value
+                FROM portfolio
+                WHERE fund = :fund
+            """),
+            conn,
+            params={"fund": fund}
+        )
 
-        # =========================
-        # INSERT NAV GROSS
-        # =========================
+        units = get_outstanding_units(conn, fund)
 
-        conn.execute(text("""
-            INSERT INTO nav (nav_date, nav_total)
-            VALUES (:d, :nav)
-        """), {
-            "d": today,
-            "nav": nav_gross
-        })
+        traded = conn.execute(
+            text("""
+                SELECT COALESCE(SUM(ABS(cash_flow)), 0)
+                FROM fundshare_trades
+                WHERE CAST(trade_date AS DATE) = :d
+                  AND status = 'SUCCESS'
+                  AND fund = :fund
+            """),
+            {"d": nav_date, "fund": fund}
+        ).scalar()
 
+        schedule = load_fee_schedule(conn, fund)
 
-        # =========================
-        # DELETE TODAY COST
-        # =========================
+    rates = {
+        f"{t}_rate": float(fee_rates_for_dates(schedule, t, [nav_date]).iloc[0])
+        for t in ("management_fee", "transaction_fee")
+    }
 
-        conn.execute(text("""
-            DELETE FROM costs
-            WHERE cost_date = :d
-        """), {"d": today})
+    return {
+        "portfolio": portfolio,
+        "units": float(units),
+        "traded": float(traded or 0),
+        "rates": rates,
+    }
 
 
-        # =========================
-        # MANAGEMENT FEE
-        # =========================
+@st.cache_data(ttl=5)
+def load_nav_preview_inputs(
+    nav_date: date | None = None,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    return read_nav_preview_inputs(get_engine(), nav_date, fund)
+
+
+def preview_nav(
+    portfolio: pd.DataFrame,
+    units: float,
+    traded: float = 0.0,
+    price_overrides: dict | None = None,
+    pending_trades: list | None = None,
+    pending_fundshare: list | None = None,
+    management_fee_rate: float = MANAGEMENT_FEE_RATE,
+    transaction_fee_rate: float = TRANSACTION_FEE_RATE
+) -> dict:
+    """
+    Tính NAV giống run_nav_pipeline nhưng hoàn toàn trong bộ nhớ.
 
-        conn.execute(text("""
-            INSERT INTO costs (
-                cost_date,
-                cost_type,
-                cost,
-                cost_category,
-                rate
-            )
-            VALUES (
-                :d,
-                'management_fee',
-                :nav * 0.0015 / 365,
-                'Management',
-                0.0015
-            )
-        """), {
-            "d": today,
-            "nav": nav_gross
-        })
-
-
-        # =========================
-        # TRANSACTION FEE
-        # =========================
-
-        conn.execute(text("""
-            INSERT INTO costs (
-                cost_date,
-                cost_type,
-                cost,
-                cost_category,
-                rate
-            )
-            SELECT
-                :d,
-                'transaction_fee',
-                COALESCE(SUM(ABS(cash_flow) * 0.0015),0),
-                'Trading',
-                0.0015
-            FROM fundshare_trades
-            WHERE trade_date = :d
-            AND status='SUCCESS'
-        """), {"d": today})
-
-
-        # =========================
-        # TOTAL COST
-        # =========================
-
-        total_cost = conn.execute(text("""
-            SELECT COALESCE(SUM(cost),0)
-            FROM costs
-            WHERE cost_date = :d
-        """), {"d": today}).scalar()
-
-
-        nav_net = nav_gross - total_cost
-
-
-        # =========================
-        # CURRENT UNITS
-        # =========================
-
-        units = conn.execute(text("""
-            SELECT
-                COALESCE(SUM(
-                    CASE
-                        WHEN side='BUY'
-                        THEN quantity
-                        WHEN side='SELL'
-                        THEN -quantity
-                    END
-                ),0)
-            FROM fundshare_trades
-            WHERE trade_date <= :d
-            AND status='SUCCESS'
-        """), {"d": today}).scalar()
-
-
-        if units <= 0:
-            raise ValueError("Outstanding units <= 0")
-
-
-        nav_per_unit = nav_net / units
-
-
-        # =========================
-        # UPDATE NAV
-        # =========================
-
-        conn.execute(text("""
-            UPDATE nav
-            SET
-                nav_total = :nav_net,
-                current_units = :units,
-                nav_per_unit = :p
-            WHERE nav_date = :d
-        """), {
-            "d": today,
-            "nav_net": nav_net,
-            "units": units,
-            "p": nav_per_unit
-        })
-
-
-        return {
-            "nav_gross": nav_gross,
-            "total_cost": total_cost,
-            "nav_net": nav_net,
-            "units": units,
-            "nav_per_unit": nav_per_unit
-        }
+    price_overrides: {ticker: giá giả định}
+    pending_trades: trade tài sản (như build_trade_record) chưa xử lý
+    pending_fundshare: giao dịch CCQ giả định,
+        mỗi dict có side (BUY/SELL), quantity (units), cash_flow (vào quỹ)
+    """
+    df = portfolio.copy()
+    df["ticker"] = df["ticker"].astype(str).str.upper()
+    for col in ("quantity", "market_price", "net_value"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
+
+    is_cash = df["asset_type"] == "Cash"
+
+    if price_overrides:
+        overrides = {t.upper(): float(p) for t, p in price_overrides.items()}
+        mask = ~is_cash & df["ticker"].isin(overrides)
+        df.loc[mask, "market_price"] = df.loc[mask, "ticker"].map(overrides)
+
+    cash_delta = 0.0
+
+    for t in pending_trades or []:
+        ticker = t["ticker"].upper()
+        qty = float(t["quantity"]) * (1 if t["side"].capitalize() == "Buy" else -1)
+        mask = ~is_cash & (df["ticker"] == ticker)
+
+        if mask.any():
+            df.loc[mask, "quantity"] += qty
+        else:
+            df = pd.concat([df, pd.DataFrame([{
+                "ticker": ticker,
+                "asset_type": "Stock",
+                "quantity": qty,
+                "market_price": float(t["price"]),
+                "net_value": 0.0,
+            }])], ignore_index=True)
+            is_cash = df["asset_type"] == "Cash"
+
+        cash_delta += float(t["cash_flow"])
+
+    for f in pending_fundshare or []:
+        sign = 1 if f["side"].upper() == "BUY" else -1
+        units += sign * float(f["quantity"])
+        cash_delta += float(f["cash_flow"])
+        traded += abs(float(f["cash_flow"]))
+
+    nav_gross = (
+        df.loc[is_cash, "net_value"].sum()
+        + (df.loc[~is_cash, "quantity"] * df.loc[~is_cash, "market_price"]).sum()
+        + cash_delta
+    )
+
+    management_fee = nav_gross * management_fee_rate / 365
+    transaction_fee = traded * transaction_fee_rate
+    total_cost = management_fee + transaction_fee
+    nav_net = nav_gross - total_cost
+
+    return {
+        "nav_gross": float(nav_gross),
+        "management_fee": float(management_fee),
+        "transaction_fee": float(transaction_fee),
+        "total_cost": float(total_cost),
+        "nav_net": float(nav_net),
+        "units": float(units),
+        "nav_per_unit": float(nav_net / units) if units > 0 else None,
+    }
@@ -0,0 +1,310 @@
+"""
+Biểu phí + accrual phí quản lý / giao dịch theo ngày, có catch-up cho các
+ngày bị bỏ sót (admin không bấm chạy NAV). Phí quản lý luôn tính trên NAV
+gross (trước phí) như fn_run_nav_pipeline và compute_nav_frame.
+
+    python -m scripts.fees                     # accrue tới hôm qua
+    python -m scripts.fees --through 2026-10-16 --fund A
+"""
+import datetime
+
+import pandas as pd
+from sqlalchemy import text
+
+from scripts.funds import DEFAULT_FUND
+
+# ==============================
+# CONFIG
+# ==============================
+# biểu phí mặc định (fund = '*'), seed 1 lần vào fee_schedule
+DEFAULT_FEE_RATES = {
+    "management_fee": 0.0015,
+    "transaction_fee": 0.0015,
+}
+
+FEE_CATEGORIES = {
+    "management_fee": "Management",
+    "transaction_fee": "Trading",
+}
+
+# phí quản lý tính theo năm, chia đều cho ngày lịch
+DAYS_PER_YEAR = 365
+
+# khoá advisory accrual: 1 lượt catch-up / quỹ tại 1 thời điểm
+_FEE_LOCK = "fees:"
+
+_SCHEDULE_EPOCH = datetime.date(1900, 1, 1)
+
+FEE_SCHEDULE_DDL = """
+CREATE TABLE IF NOT EXISTS fee_schedule (
+    fund           TEXT NOT NULL,          -- '*' = mọi quỹ
+    cost_type      TEXT NOT NULL,
+    rate           NUMERIC NOT NULL CHECK (rate >= 0),
+    effective_from DATE NOT NULL,
+    PRIMARY KEY (fund, cost_type, effective_from)
+);
+
+-- biểu phí hiệu lực của quỹ tại 1 ngày; dòng riêng của quỹ thắng '*'
+CREATE OR REPLACE FUNCTION fn_fee_rate(p_fund TEXT, p_type TEXT, p_date DATE)
+RETURNS NUMERIC
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT s.rate
+    FROM fee_schedule s
+    WHERE s.fund IN (p_fund, '*')
+      AND s.cost_type = p_type
+      AND s.effective_from <= p_date
+    ORDER BY s.effective_from DESC, (s.fund = p_fund) DESC
+    LIMIT 1
+$$;
+
+-- catch-up phí cho mọi ngày sau lần accrual management_fee gần nhất tới
+-- p_through, 1 INSERT set-based (gọi được trong fn_run_nav, không round trip)
+CREATE OR REPLACE FUNCTION fn_accrue_fee_gaps(p_fund TEXT, p_through DATE)
+RETURNS TABLE (start_date DATE, days INTEGER, rows_inserted BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_start DATE;
+    v_rows  BIGINT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('{fee_lock}' || p_fund), 0);
+
+    -- lần accrual gần nhất; chưa có thì bắt đầu từ NAV đầu tiên
+    v_start := COALESCE(
+        (
+            SELECT MAX(c.cost_date) + 1
+            FROM costs c
+            WHERE c.fund = p_fund
+              AND c.cost_type = 'management_fee'
+        ),
+        (
+            SELECT MIN(n.nav_date)
+            FROM nav n
+            WHERE n.fund = p_fund
+        )
+    );
+
+    IF v_start IS NULL OR v_start > p_through THEN
+        RETURN QUERY SELECT v_start, 0, CAST(0 AS BIGINT);
+        RETURN;
+    END IF;
+
+    INSERT INTO costs (cost_date, cost_type, cost, cost_category, rate, fund)
+    WITH days AS (
+        SELECT CAST(g AS DATE) AS d
+        FROM generate_series(v_start, p_through, INTERVAL '1 day') AS g
+    ),
+
+    -- NAV gross as-of từng ngày = nav_total (net) + phí của ngày NAV đó;
+    -- ngày chưa có NAV nào trước đó bị bỏ qua (quỹ chưa hoạt động)
+    base AS (
+        SELECT days.d, a.nav_gross
+        FROM days
+        JOIN LATERAL (
+            SELECT n.nav_total + COALESCE((
+                SELECT SUM(c.cost)
+                FROM costs c
+                WHERE c.fund = p_fund
+                  AND c.cost_date = n.nav_date
+            ), 0) AS nav_gross
+            FROM nav n
+            WHERE n.fund = p_fund
+              AND n.nav_date <= days.d
+            ORDER BY n.nav_date DESC
+            LIMIT 1
+        ) a ON TRUE
+    ),
+
+    traded AS (
+        SELECT
+            CAST(f.trade_date AS DATE) AS d,
+            SUM(ABS(f.cash_flow)) AS traded
+        FROM fundshare_trades f
+        WHERE f.fund = p_fund
+          AND f.status = 'SUCCESS'
+          AND f.trade_date >= v_start
+          AND f.trade_date < p_through + 1
+        GROUP BY 1
+    ),
+
+    rated AS (
+        SELECT
+            b.d,
+            b.nav_gross,
+            COALESCE(t.traded, 0) AS traded,
+            fn_fee_rate(p_fund, 'management_fee', b.d) AS mgmt_rate,
+            fn_fee_rate(p_fund, 'transaction_fee', b.d) AS txn_rate
+        FROM base b
+        LEFT JOIN traded t
+          ON t.d = b.d
+    )
+
+    SELECT r.d, v.cost_type, v.cost, v.category, v.rate, p_fund
+    FROM rated r
+    CROSS JOIN LATERAL (
+        VALUES
+            ('management_fee', r.nav_gross * r.mgmt_rate / {days_per_year},
+             '{mgmt_category}', r.mgmt_rate),
+            ('transaction_fee', r.traded * r.txn_rate,
+             '{txn_category}', r.txn_rate)
+    ) AS v(cost_type, cost, category, rate)
+    WHERE v.rate IS NOT NULL
+    ORDER BY r.d, v.cost_type;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    RETURN QUERY
+    SELECT v_start, (p_through - v_start) + 1, v_rows;
+END;
+$$;
+""".format(
+    fee_lock=_FEE_LOCK,
+    days_per_year=DAYS_PER_YEAR,
+    mgmt_category=FEE_CATEGORIES["management_fee"],
+    txn_category=FEE_CATEGORIES["transaction_fee"],
+)
+
+
+# ==============================
+# 1️⃣ BIỂU PHÍ
+# ==============================
+def ensure_fee_schedule(conn):
+    """
+    Tạo fee_schedule + fn_fee_rate và seed biểu phí mặc định (DDL: chỉ gọi
+    từ scripts.migrate).
+    """
+    conn.execute(text(FEE_SCHEDULE_DDL))
+
+    conn.execute(
+        text("""
+            INSERT INTO fee_schedule (fund, cost_type, rate, effective_from)
+            SELECT '*', t, r, :epoch
+            FROM unnest(CAST(:types AS text[]), CAST(:rates AS numeric[])) AS v(t, r)
+            ON CONFLICT DO NOTHING
+        """),
+        {
+            "types": list(DEFAULT_FEE_RATES),
+            "rates": list(DEFAULT_FEE_RATES.values()),
+            "epoch": _SCHEDULE_EPOCH,
+        }
+    )
+
+
+def set_fee_rate(
+    engine,
+    cost_type: str,
+    rate: float,
+    effective_from: datetime.date,
+    fund: str = "*"
+):
+    if cost_type not in DEFAULT_FEE_RATES:
+        raise ValueError(f"cost_type must be one of {tuple(DEFAULT_FEE_RATES)}")
+
+    if rate < 0:
+        raise ValueError("rate must be >= 0")
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO fee_schedule (fund, cost_type, rate, effective_from)
+                VALUES (:fund, :type, :rate, :d)
+                ON CONFLICT (fund, cost_type, effective_from)
+                DO UPDATE SET rate = EXCLUDED.rate
+            """),
+            {"fund": fund, "type": cost_type, "rate": rate, "d": effective_from}
+        )
+
+
+def load_fee_schedule(conn, fund: str = DEFAULT_FUND) -> pd.DataFrame:
+    """
+    Các dòng biểu phí áp dụng cho quỹ (riêng + '*').
+    """
+    df = pd.read_sql(
+        text("""
+            SELECT fund, cost_type, rate, effective_from
+            FROM fee_schedule
+            WHERE fund IN (:fund, '*')
+        """),
+        conn,
+        params={"fund": fund}
+    )
+
+    df["rate"] = df["rate"].astype(float)
+    df["effective_from"] = pd.to_datetime(df["effective_from"])
+    # merge_asof lấy dòng cuối cùng <= ngày: xếp dòng riêng của quỹ sau '*'
+    df["specific"] = df["fund"] != "*"
+    return df.sort_values(["effective_from", "specific"]).reset_index(drop=True)
+
+
+def fee_rates_for_dates(schedule: pd.DataFrame, cost_type: str, dates) -> pd.Series:
+    """
+    Rate hiệu lực cho từng ngày trong dates (vector hoá, NaN nếu không có).
+    """
+    dates = pd.DatetimeIndex(dates)
+    rows = schedule[schedule["cost_type"] == cost_type]
+
+    if rows.empty:
+        return pd.Series(float("nan"), index=dates)
+
+    # merge_asof cần 2 khoá cùng độ phân giải thời gian
+    asof = pd.merge_asof(
+        pd.DataFrame({"d": dates.astype("datetime64[ns]")}),
+        rows[["effective_from", "rate"]].astype({"effective_from": "datetime64[ns]"}),
+        left_on="d",
+        right_on="effective_from",
+    )
+    return pd.Series(asof["rate"].to_numpy(), index=dates)
+
+
+# ==============================
+# 2️⃣ CATCH-UP (DB)
+# ==============================
+def accrue_fee_gaps(
+    conn,
+    through: datetime.date,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Ghi phí cho mọi ngày từ sau lần accrual gần nhất tới through, trong
+    transaction của conn: 1 lời gọi fn_accrue_fee_gaps.
+    """
+    row = conn.execute(
+        text("SELECT * FROM fn_accrue_fee_gaps(:fund, :through)"),
+        {"fund": fund, "through": through}
+    ).mappings().one()
+
+    return {
+        "start": row["start_date"],
+        "through": through,
+        "days": row["days"] if row["rows_inserted"] else 0,
+        "rows": row["rows_inserted"],
+    }
+
+
+def accrue_fees(
+    engine,
+    through: datetime.date | None = None,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Catch-up phí tới through (mặc định hôm qua; hôm nay do NAV daily ghi).
+    """
+    through = through or datetime.date.today() - datetime.timedelta(days=1)
+
+    with engine.begin() as conn:
+        return accrue_fee_gaps(conn, through, fund)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from scripts.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description="Accrue missing fee days")
+    parser.add_argument("--through", type=datetime.date.fromisoformat, default=None)
+    parser.add_argument("--fund", default=DEFAULT_FUND)
+    args = parser.parse_args()
+
+    print(accrue_fees(get_engine(), args.through, args.fund))
@@ -0,0 +1,174 @@
+"""
+Outstanding units (CCQ đang lưu hành) duy trì tăng dần trong bảng fund_units,
+1 dòng mỗi quỹ, cập nhật cùng transaction với execute_fundshare_trade, để NAV
+không phải quét toàn bộ fundshare_trades.
+
+    python -m scripts.fund_units                # so aggregate với full scan
+    python -m scripts.fund_units --fix          # ghi đè aggregate nếu lệch
+    python -m scripts.fund_units --fund A --fix
+"""
+from sqlalchemy import text
+
+from scripts.funds import DEFAULT_FUND
+
+# sai số cho phép khi so aggregate với full scan
+UNITS_TOLERANCE = 1e-6
+
+_SCAN_UNITS = """
+    SELECT COALESCE(SUM(
+        CASE
+            WHEN side='BUY' THEN quantity
+            WHEN side='SELL' THEN -quantity
+        END
+    ), 0)
+    FROM fundshare_trades
+    WHERE status='SUCCESS'
+      AND fund = :fund
+"""
+
+
+# ==============================
+# 1️⃣ SCHEMA + SEED (MIGRATION)
+# ==============================
+def ensure_fund_units(conn):
+    """
+    Tạo bảng fund_units (DDL: chỉ gọi từ scripts.migrate).
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS fund_units (
+            fund       TEXT PRIMARY KEY,
+            units      NUMERIC NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        -- bảng 1 dòng (id = 1) cũ -> 1 dòng mỗi quỹ
+        ALTER TABLE fund_units
+            ADD COLUMN IF NOT EXISTS fund TEXT NOT NULL DEFAULT '{DEFAULT_FUND}';
+        ALTER TABLE fund_units DROP COLUMN IF EXISTS id;
+        CREATE UNIQUE INDEX IF NOT EXISTS fund_units_fund_key
+            ON fund_units (fund);
+    """))
+
+
+def seed_fund_units(conn, funds) -> int:
+    """
+    Seed dòng aggregate từ full scan cho các quỹ chưa có (1 statement).
+    """
+    return conn.execute(
+        text("""
+            INSERT INTO fund_units (fund, units)
+            SELECT f.fund, COALESCE(s.units, 0)
+            FROM unnest(CAST(:funds AS text[])) AS f(fund)
+            LEFT JOIN (
+                SELECT
+                    fund,
+                    SUM(
+                        CASE
+                            WHEN side='BUY' THEN quantity
+                            WHEN side='SELL' THEN -quantity
+                        END
+                    ) AS units
+                FROM fundshare_trades
+                WHERE status='SUCCESS'
+                GROUP BY fund
+            ) s
+              ON s.fund = f.fund
+            ON CONFLICT (fund) DO NOTHING
+        """),
+        {"funds": list(funds)}
+    ).rowcount
+
+
+# ==============================
+# 2️⃣ AGGREGATE
+# ==============================
+def get_outstanding_units(conn, fund: str = DEFAULT_FUND) -> float:
+    units = conn.execute(
+        text("""
+            SELECT units FROM fund_units WHERE fund = :fund
+        """),
+        {"fund": fund}
+    ).scalar()
+
+    return float(units or 0)
+
+
+def apply_units_delta(conn, delta: float, fund: str = DEFAULT_FUND):
+    """
+    Cộng delta (BUY +, SELL -) vào aggregate của quỹ; gọi trong transaction
+    ghi trade. Quỹ mới (chưa có dòng, chưa có trade) bắt đầu từ delta.
+    """
+    conn.execute(
+        text("""
+            INSERT INTO fund_units (fund, units)
+            VALUES (:fund, :delta)
+            ON CONFLICT (fund)
+            DO UPDATE SET
+                units = fund_units.units + EXCLUDED.units,
+                updated_at = now()
+        """),
+        {"delta": delta, "fund": fund}
+    )
+
+
+# ==============================
+# 3️⃣ VERIFY
+# ==============================
+def verify_outstanding_units(
+    engine,
+    fix: bool = False,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    So aggregate của quỹ với full scan fundshare_trades. fix=True ghi đè khi lệch.
+    """
+    params = {"fund": fund}
+
+    with engine.begin() as conn:
+        # khoá dòng aggregate để không có trade chen giữa 2 lần đọc
+        aggregate = float(conn.execute(text("""
+            SELECT units FROM fund_units WHERE fund = :fund FOR UPDATE
+        """), params).scalar() or 0)
+
+        scanned = float(conn.execute(text(_SCAN_UNITS), params).scalar())
+
+        drift = aggregate - scanned
+        ok = abs(drift) <= UNITS_TOLERANCE
+
+        if not ok and fix:
+            conn.execute(
+                text("""
+                    INSERT INTO fund_units (fund, units)
+                    VALUES (:fund, :units)
+                    ON CONFLICT (fund)
+                    DO UPDATE SET
+                        units = EXCLUDED.units,
+                        updated_at = now()
+                """),
+                {"units": scanned, "fund": fund}
+            )
+
+    return {
+        "aggregate": aggregate,
+        "scanned": scanned,
+        "drift": drift,
+        "ok": ok,
+        "fixed": not ok and fix,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from scripts.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description="Verify fund_units aggregate")
+    parser.add_argument("--fix", action="store_true")
+    parser.add_argument("--fund", default=DEFAULT_FUND)
+    args = parser.parse_args()
+
+    result = verify_outstanding_units(get_engine(), fix=args.fix, fund=args.fund)
+    print(result)
+
+    sys.exit(0 if result["ok"] or result["fixed"] else 1)
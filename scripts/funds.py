@@ -0,0 +1,294 @@
+"""
+Nhiều quỹ trên 1 deployment: NAV / costs / snapshot chạy riêng theo quỹ
+(users.fund), mỗi quỹ 1 worker process với kết nối riêng.
+
+    python -m scripts.funds                          # daily run mọi quỹ
+    python -m scripts.funds --date 2026-10-16 --workers 4
+    python -m scripts.funds --fund A --fund B
+"""
+import datetime
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import text
+
+# ==============================
+# CONFIG
+# ==============================
+# dữ liệu cũ (trước khi có multi-fund) thuộc quỹ này
+DEFAULT_FUND = os.getenv("DEFAULT_FUND", "default")
+
+# các bảng dữ liệu được phân vùng theo quỹ
+FUND_TABLES = (
+    "portfolio",
+    "trades",
+    "fundshare_trades",
+    "costs",
+    "nav",
+    "overall_snapshot",
+)
+
+# index (fund, cột ngày) cho các bảng pipeline lọc theo ngày
+_FUND_INDEXES = {
+    "nav": "nav_date",
+    "costs": "cost_date",
+    "fundshare_trades": "trade_date",
+    "overall_snapshot": "snapshot_time",
+}
+
+
+# ==============================
+# 1️⃣ SCHEMA
+# ==============================
+def ensure_fund_columns(conn):
+    """
+    Thêm cột fund (mặc định DEFAULT_FUND) cho các bảng pipeline; dữ liệu cũ
+    tự thuộc quỹ mặc định. DDL: chỉ gọi từ scripts.migrate.
+    """
+    for table in FUND_TABLES:
+        conn.execute(text(f"""
+            ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS fund TEXT NOT NULL
+            DEFAULT '{DEFAULT_FUND}'
+        """))
+
+    for table, column in _FUND_INDEXES.items():
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {table}_fund_{column}_idx
+            ON {table} (fund, {column})
+        """))
+
+
+def ensure_portfolio_fund_key(conn):
+    """
+    Khoá portfolio theo (fund, ticker) thay cho (ticker): mỗi quỹ có dòng
+    YTM / mã riêng. DDL: chỉ gọi từ scripts.migrate.
+    """
+    conn.execute(text("""
+        DO $$
+        DECLARE
+            v_ticker SMALLINT;
+            r RECORD;
+        BEGIN
+            SELECT attnum INTO v_ticker
+            FROM pg_attribute
+            WHERE attrelid = 'portfolio'::regclass
+              AND attname = 'ticker';
+
+            -- PK / UNIQUE cũ chỉ trên (ticker)
+            FOR r IN
+                SELECT conname
+                FROM pg_constraint
+                WHERE conrelid = 'portfolio'::regclass
+                  AND contype IN ('p', 'u')
+                  AND conkey = ARRAY[v_ticker]
+            LOOP
+                EXECUTE format('ALTER TABLE portfolio DROP CONSTRAINT %I', r.conname);
+            END LOOP;
+
+            -- unique index (không thuộc constraint) chỉ trên (ticker)
+            FOR r IN
+                SELECT c.relname
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = 'portfolio'::regclass
+                  AND i.indisunique
+                  AND i.indkey::text = v_ticker::text
+            LOOP
+                EXECUTE format('DROP INDEX %I', r.relname);
+            END LOOP;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'portfolio'::regclass
+                  AND contype = 'p'
+            ) THEN
+                ALTER TABLE portfolio ADD PRIMARY KEY (fund, ticker);
+            END IF;
+        END
+        $$;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS portfolio_fund_ticker_key
+            ON portfolio (fund, ticker);
+    """))
+
+
+def seed_fund_cash(conn, funds) -> int:
+    """
+    Dòng tiền mặt YTM (0) cho các quỹ chưa có, 1 statement.
+    """
+    return conn.execute(
+        text("""
+            INSERT INTO portfolio (
+                ticker,
+                asset_name,
+                asset_type,
+                quantity,
+                buy_price,
+                market_price,
+                net_value,
+                interest,
+                price_date,
+                fund
+            )
+            SELECT
+                'YTM',
+                NULL,
+                'Cash',
+                0,
+                0,
+                0,
+                0,
+                0,
+                CURRENT_DATE,
+                f.fund
+            FROM unnest(CAST(:funds AS text[])) AS f(fund)
+            ON CONFLICT (fund, ticker) DO NOTHING
+        """),
+        {"funds": list(funds)}
+    ).rowcount
+
+
+def known_funds(conn) -> list:
+    """
+    Quỹ của user + quỹ đang có vị thế (luôn gồm DEFAULT_FUND).
+    """
+    rows = conn.execute(
+        text("""
+            SELECT fund FROM users WHERE fund IS NOT NULL
+            UNION
+            SELECT DISTINCT fund FROM portfolio
+            UNION
+            SELECT :default
+            ORDER BY 1
+        """),
+        {"default": DEFAULT_FUND}
+    ).scalars().all()
+
+    return list(rows)
+
+
+def list_funds(engine) -> list:
+    """
+    Các quỹ cần chạy daily.
+    """
+    with engine.connect() as conn:
+        return known_funds(conn)
+
+
+def fund_of_customer(conn, customer_id) -> str:
+    fund = conn.execute(
+        text("""
+            SELECT fund
+            FROM users
+            WHERE customer_id = :cid
+            LIMIT 1
+        """),
+        {"cid": customer_id}
+    ).scalar()
+
+    return fund or DEFAULT_FUND
+
+
+# ==============================
+# 2️⃣ DAILY RUN 1 QUỸ (WORKER)
+# ==============================
+def _run_fund_daily(fund: str, nav_date: datetime.date) -> dict:
+    """
+    Chạy trong worker process: engine riêng, snapshot rồi NAV của 1 quỹ.
+    """
+    from sqlalchemy import create_engine
+
+    from scripts.db import run_nav_pipeline, update_overall_snapshot
+    from scripts.db_engine import DATABASE_URL
+
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=1,
+        max_overflow=1,
+        pool_pre_ping=True,
+    )
+
+    t0 = time.perf_counter()
+
+    try:
+        update_overall_snapshot(engine, fund=fund)
+        result = run_nav_pipeline(engine, nav_date, fund=fund)
+    except Exception as e:
+        return {
+            "fund": fund,
+            "ok": False,
+            "error": str(e),
+            "seconds": time.perf_counter() - t0,
+        }
+    finally:
+        engine.dispose()
+
+    return {
+        "fund": fund,
+        "ok": True,
+        "nav_per_unit": float(result["nav_per_unit"]),
+        "reused": result["reused"],
+        "run_id": result["run_id"],
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# ==============================
+# 3️⃣ DAILY RUN MỌI QUỸ (SONG SONG)
+# ==============================
+def run_daily_all_funds(
+    engine,
+    nav_date: datetime.date | None = None,
+    funds: list | None = None,
+    max_workers: int | None = None
+) -> list:
+    """
+    Chạy daily cho từng quỹ song song, mỗi quỹ 1 process (spawn, không dùng
+    chung kết nối với process cha). Lỗi của 1 quỹ không chặn quỹ khác.
+    Schema phải đã được migrate (python -m scripts.migrate).
+    """
+    nav_date = nav_date or datetime.date.today()
+
+    funds = funds or list_funds(engine)
+    max_workers = max_workers or min(len(funds), os.cpu_count() or 1)
+
+    results = []
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        futures = [pool.submit(_run_fund_daily, f, nav_date) for f in funds]
+
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    return sorted(results, key=lambda r: r["fund"])
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from scripts.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description="Daily NAV run for every fund")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, default=None)
+    parser.add_argument("--fund", action="append", dest="funds")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    results = run_daily_all_funds(
+        get_engine(), args.date, funds=args.funds, max_workers=args.workers
+    )
+
+    for r in results:
+        if r["ok"]:
+            print(f"{r['fund']:<16} OK    {r['nav_per_unit']:>14,.4f}  {r['seconds']:.2f}s")
+        else:
+            print(f"{r['fund']:<16} FAIL  {r['error']}")
+
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
@@ -1,6 +1,8 @@
 from datetime import datetime
 from sqlalchemy import text
 from scripts.db_engine import get_engine
+from scripts.fund_units import apply_units_delta
+from scripts.funds import DEFAULT_FUND, fund_of_customer, seed_fund_cash
 
 
 
@@ -8,16 +10,18 @@ from scripts.db_engine import get_engine
 # ======================
 # LẤY NAV / CCQ
 # ======================
-def get_latest_nav_per_unit() -> float:
+def get_latest_nav_per_unit(fund: str = DEFAULT_FUND) -> float:
     engine = get_engine()
     with engine.connect() as conn:
         nav = conn.execute(
             text("""
                 SELECT nav_per_unit
                 FROM nav
+                WHERE fund = :fund
                 ORDER BY nav_date DESC
                 LIMIT 1
-            """)
+            """),
+            {"fund": fund}
         ).scalar()
 
 
@@ -108,7 +112,11 @@ def execute_fundshare_trade(
 
 
     engine = get_engine()
-    nav = get_latest_nav_per_unit()
+
+    with engine.connect() as conn:
+        fund = fund_of_customer(conn, customer_id)
+
+    nav = get_latest_nav_per_unit(fund)
     fee_rate = get_fundshare_fee_rate(side)
 
 
@@ -152,14 +160,20 @@ def execute_fundshare_trade(
         # ======================
         # 2️⃣ LẤY CASH QUỸ (YTM)
         # ======================
-        cash_row = conn.execute(
-            text("""
-                SELECT net_value
-                FROM portfolio
-                WHERE ticker = 'YTM'
-                FOR UPDATE
-            """)
-        ).fetchone()
+        select_cash = text("""
+            SELECT net_value
+            FROM portfolio
+            WHERE ticker = 'YTM'
+              AND fund = :fund
+            FOR UPDATE
+        """)
+
+        cash_row = conn.execute(select_cash, {"fund": fund}).fetchone()
+
+        if cash_row is None:
+            # quỹ mới chưa qua migrate: tạo dòng YTM = 0 rồi đọc lại
+            seed_fund_cash(conn, [fund])
+            cash_row = conn.execute(select_cash, {"fund": fund}).fetchone()
 
 
 
@@ -245,6 +259,10 @@ def execute_fundshare_trade(
 
 
 
+        # cập nhật outstanding units cùng transaction
+        apply_units_delta(conn, units if side == "BUY" else -units, fund)
+
+
         # ======================
         # 5️⃣ GHI TRADE
         # ======================
@@ -258,12 +276,13 @@ def execute_fundshare_trade(
                     price,
                     cost,
                     cash_flow,
-                    current_fs
+                    current_fs,
+                    fund
                 )
                 VALUES (
                     :d, :cid, :side,
                     :qty, :price, :fee,
-                    :cf, :fs
+                    :cf, :fs, :fund
                 )
             """),
             {
@@ -274,7 +293,8 @@ def execute_fundshare_trade(
                 "price": nav,
                 "fee": fee,
                 "cf": cash_change,
-                "fs": new_nos
+                "fs": new_nos,
+                "fund": fund
             }
         )
 
@@ -309,8 +329,9 @@ def execute_fundshare_trade(
                 UPDATE portfolio
                 SET net_value = net_value + :delta
                 WHERE ticker = 'YTM'
+                  AND fund = :fund
             """),
-            {"delta": cash_change}
+            {"delta": cash_change, "fund": fund}
         )
 
 
@@ -0,0 +1,184 @@
+"""
+Import-time budget cho các page Streamlit.
+
+    python -m scripts.import_budget            # kiểm tra mọi page
+    python -m scripts.import_budget --budget 2.5
+    python -m pytest tests/test_import_budget.py
+
+Mỗi page được import trong 1 process Python mới với `-X importtime` (cold
+import), tính cả streamlit / pandas / sqlalchemy mà page kéo theo: đo từ
+lúc bắt đầu import page, không import sẵn thư viện nào. Fail khi thời gian
+import vượt budget hoặc page kéo theo module nặng bị cấm import sớm
+(yfinance, supabase, plotly) — các module này phải import lazy bên trong
+hàm dùng chúng.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# ==============================
+# CONFIG
+# ==============================
+# front.auth: page đầu tiên mọi cold start đều import (login)
+PAGE_MODULES = [
+    "front.auth",
+    "front.overall_admin",
+    "front.portfolio",
+    "front.cash",
+    "front.exchange",
+    "front.information",
+    "front.overall_investor",
+]
+
+# giây, cold import 1 page kể cả thư viện bên thứ ba
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET", "3.0"))
+
+LAZY_ONLY = ("yfinance", "supabase", "plotly")
+
+# số package top-level tốn nhất in kèm mỗi page
+TOP_IMPORTS = 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:  self [us] | cumulative | <indent>module"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$")
+
+
+# ==============================
+# 1️⃣ ĐO 1 PAGE
+# ==============================
+def parse_importtime(stderr: str) -> list:
+    """
+    [(module, cumulative_seconds, depth)] theo thứ tự import xong.
+    """
+    rows = []
+
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            rows.append((module, int(cumulative) / 1e6, len(indent) // 2))
+
+    return rows
+
+
+def _eager_imports(rows, own_packages) -> set:
+    """
+    Module LAZY_ONLY được import trực tiếp từ code của repo (own_packages).
+    Import do thư viện bên thứ ba tự kéo (vd streamlit thử import plotly)
+    vẫn tính vào thời gian nhưng không phải lỗi của page.
+    """
+    eager = set()
+
+    for i, (m, _, d) in enumerate(rows):
+        root = m.split(".")[0]
+        if root not in LAZY_ONLY or d == 0:
+            continue
+
+        # importer: dòng kế tiếp nông hơn 1 mức (importtime in con trước cha)
+        parent = next((pm for pm, _, pd_ in rows[i + 1:] if pd_ == d - 1), "")
+
+        if parent.split(".")[0] in own_packages:
+            eager.add(root)
+
+    return eager
+
+
+def measure_import(module: str) -> dict:
+    """
+    Cold import `module` trong interpreter mới. seconds: thời gian import
+    page kể cả thư viện nó kéo theo (không tính khởi động interpreter);
+    top: các package tốn nhất; heavy: module LAZY_ONLY bị import.
+    """
+    # in các package đã nạp thật (import lỗi trong try/except vẫn có dòng
+    # importtime), sau khi đo xong nên không ảnh hưởng thời gian
+    code = (
+        f"import {module}\n"
+        "import sys\n"
+        "print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    )
+
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    rows = parse_importtime(out.stderr)
+
+    # bỏ phần khởi động interpreter (kết thúc bằng `site`): còn lại là các
+    # import do `import module` gây ra
+    site = max((i for i, (m, _, d) in enumerate(rows) if d == 0 and m == "site"), default=-1)
+    rows = rows[site + 1:]
+
+    seconds = sum(s for _, s, d in rows if d == 0)
+
+    # cumulative của từng package gốc ngay dưới page (streamlit, pandas, ...)
+    page_root = module.split(".")[0]
+    packages = {}
+    for m, s, d in rows:
+        root = m.split(".")[0]
+        if d <= 1 and root != page_root:
+            packages[root] = max(packages.get(root, 0.0), s)
+
+    loaded = set(out.stdout.strip().splitlines()[-1].split())
+    heavy = sorted(_eager_imports(rows, ("front", "scripts")) & loaded)
+
+    return {
+        "seconds": seconds,
+        "top": sorted(packages.items(), key=lambda kv: -kv[1])[:TOP_IMPORTS],
+        "heavy": heavy,
+    }
+
+
+# ==============================
+# 2️⃣ KIỂM TRA
+# ==============================
+def check_module(module: str, budget: float = IMPORT_BUDGET) -> list:
+    """
+    List lỗi của 1 page; rỗng nghĩa là đạt budget.
+    """
+    result = measure_import(module)
+
+    print(
+        f"{module:<28} {result['seconds'] * 1000:8.1f} ms  heavy={result['heavy']}  "
+        + ", ".join(f"{m} {s * 1000:.0f} ms" for m, s in result["top"])
+    )
+
+    errors = []
+
+    if result["seconds"] > budget:
+        errors.append(
+            f"{module}: cold import took {result['seconds']:.2f}s > {budget:.2f}s"
+        )
+
+    if result["heavy"]:
+        errors.append(
+            f"{module}: eagerly imports {', '.join(result['heavy'])}"
+        )
+
+    return errors
+
+
+def check_budget(modules=PAGE_MODULES, budget: float = IMPORT_BUDGET) -> list:
+    """
+    Trả về list lỗi; list rỗng nghĩa là mọi page đạt budget.
+    """
+    return [e for module in modules for e in check_module(module, budget)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Page import-time budget")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET)
+    args = parser.parse_args()
+
+    errors = check_budget(budget=args.budget)
+
+    for e in errors:
+        print(f"[FAIL] {e}")
+
+    sys.exit(1 if errors else 0)
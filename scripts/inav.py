@@ -0,0 +1,141 @@
+import datetime
+import threading
+
+import streamlit as st
+
+from scripts.db import preview_nav, read_nav_preview_inputs
+from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND
+from scripts.quote_board import get_quote_board
+from scripts.quote_cache import HOSE_TZ, is_session_open
+
+# ==============================
+# CONFIG
+# ==============================
+INAV_INTERVAL = 30
+
+# giây; quote trên board cũ hơn hạn này thì iNAV bị coi là stale
+INAV_MAX_AGE = 120
+
+
+# ==============================
+# 1️⃣ iNAV (IN-MEMORY)
+# ==============================
+class IndicativeNav:
+    """
+    NAV/CCQ tham khảo trong phiên của 1 quỹ, dùng chung mọi session.
+    Thread nền tính lại mỗi `interval` giây từ quote trên QuoteBoard,
+    vị thế hiện tại, phí dồn tích trong ngày và units đang lưu hành; chỉ
+    chạy khi đang trong phiên và board đang poll (ngoài phiên không có
+    quote mới). Page chỉ đọc latest(), không query DB.
+    """
+
+    def __init__(self, fund: str = DEFAULT_FUND, board=None, max_age: float = INAV_MAX_AGE):
+        self.fund = fund
+        self.board = board or get_quote_board()
+        self.max_age = max_age
+        self.last_error = None
+        self._value = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def compute_once(self, engine) -> dict:
+        inputs = read_nav_preview_inputs(engine, fund=self.fund)
+
+        quotes = {q["ticker"]: q["close_price"] for q in self.board.snapshot()}
+        held = set(inputs["portfolio"]["ticker"].astype(str).str.upper())
+
+        result = preview_nav(
+            inputs["portfolio"],
+            inputs["units"],
+            inputs["traded"],
+            price_overrides=quotes,
+            **inputs["rates"]
+        )
+
+        value = {
+            **result,
+            "fund": self.fund,
+            "computed_at": datetime.datetime.now(HOSE_TZ),
+            "quotes_as_of": self.board.polled_at,
+            "live_quotes": len(held & set(quotes)),
+        }
+
+        with self._lock:
+            self._value = value
+
+        return value
+
+    def latest(self) -> dict | None:
+        """
+        Giá trị iNAV gần nhất kèm age (giây, tính theo thời điểm quote),
+        stale_after và cờ stale; None nếu chưa tính lần nào. Không có quote
+        live cho mã nào đang giữ thì luôn stale.
+        """
+        with self._lock:
+            value = self._value
+
+        if value is None:
+            return None
+
+        quotes_as_of = value["quotes_as_of"]
+
+        if quotes_as_of is None or not value["live_quotes"]:
+            return {**value, "age": None, "stale_after": None, "stale": True}
+
+        now = datetime.datetime.now(HOSE_TZ)
+        age = (now - quotes_as_of).total_seconds()
+
+        return {
+            **value,
+            "age": age,
+            "stale_after": quotes_as_of + datetime.timedelta(seconds=self.max_age),
+            "stale": age > self.max_age,
+        }
+
+    # ==============================
+    # 2️⃣ BACKGROUND LOOP
+    # ==============================
+    def _run(self, engine, interval: float):
+        while not self._stop.is_set():
+            if is_session_open() and self.board.running:
+                try:
+                    self.compute_once(engine)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"[WARN] iNAV {self.fund}: {e}")
+
+            self._stop.wait(interval)
+
+    def start(self, engine, interval: float = INAV_INTERVAL):
+        if self.running:
+            return
+
+        # thread cũ (đã stop) có thể còn giữa 1 lượt tính: chờ nó thoát
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(engine, interval),
+            name=f"inav-{self.fund}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+
+@st.cache_resource
+def get_inav(fund: str = DEFAULT_FUND) -> IndicativeNav:
+    inav = IndicativeNav(fund)
+    inav.start(get_engine())
+    return inav
@@ -1,7 +1,10 @@
 # scripts/information.py
 import pandas as pd
 from sqlalchemy import text
+from scripts.db import load_table
 from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND, fund_of_customer
+from scripts.snapshots import compute_overall_snapshot
 
 
 
@@ -16,9 +19,18 @@ from scripts.db_engine import get_engine
         # ======
         # ADMIN
         # ======
-def load_admin_information():
+def load_admin_information(fund: str = DEFAULT_FUND):
     engine = get_engine()
 
+    # Interest toàn quỹ: snapshot tính trong bộ nhớ từ portfolio đã cache
+    # (như overall_investor), không phụ thuộc lần lưu snapshot gần nhất
+    df_port = load_table("portfolio")
+    df_port = df_port[df_port["fund"] == fund] if "fund" in df_port.columns else df_port
+
+    df_ove = compute_overall_snapshot(df_port)
+    interest = df_ove.loc[df_ove["attribute"] == "Fund share", "interest"]
+    interest = float(interest.iloc[0]) if not interest.empty and pd.notna(interest.iloc[0]) else 0.0
+
 
 
 
@@ -29,7 +41,9 @@ def load_admin_information():
                 SELECT COALESCE(SUM(net_value), 0)
                 FROM portfolio
                 WHERE asset_type = 'Cash'
-            """)
+                  AND fund = :fund
+            """),
+            {"fund": fund}
         ).scalar()
 
 
@@ -44,28 +58,16 @@ def load_admin_information():
                 SUM(quantity * buy_price) AS invested_value
             FROM portfolio
             WHERE asset_type = 'Fund share'
+              AND fund = %(fund)s
             """,
-            conn
+            conn,
+            params={"fund": fund}
         )
 
 
 
 
-        # 3️⃣ Interest toàn quỹ
-        interest = conn.execute(
-            text("""
-                SELECT interest
-                FROM overall_snapshot
-                WHERE attribute = 'Fund share'
-                ORDER BY snapshot_time DESC
-                LIMIT 1
-            """)
-        ).scalar()
-
-
-
-
-        # 4️⃣ Danh sách nhà đầu tư
+        # 3️⃣ Danh sách nhà đầu tư
         investors = pd.read_sql(
             """
             SELECT
@@ -158,13 +160,17 @@ def load_investor_portfolio(customer_id: str):
         if investor is None:
             return None
 
+        fund = fund_of_customer(conn, customer_id)
+
         nav_per_unit = conn.execute(
             text("""
                 SELECT nav_per_unit
                 FROM nav
+                WHERE fund = :fund
                 ORDER BY nav_date DESC
                 LIMIT 1
-            """)
+            """),
+            {"fund": fund}
         ).scalar()
 
         trades = pd.read_sql(
@@ -0,0 +1,60 @@
+"""
+Migration schema (DDL + seed) chạy 1 lần khi deploy, không chạy trong request:
+ALTER TABLE ... ADD COLUMN IF NOT EXISTS vẫn lấy ACCESS EXCLUSIVE trên bảng
+trước khi kiểm tra IF NOT EXISTS. Idempotent, chạy lại an toàn.
+
+    python -m scripts.migrate
+"""
+from sqlalchemy import text
+
+from scripts.corporate_actions import ensure_corporate_actions_table
+from scripts.fees import ensure_fee_schedule
+from scripts.fund_units import ensure_fund_units, seed_fund_units
+from scripts.funds import (
+    ensure_fund_columns,
+    ensure_portfolio_fund_key,
+    known_funds,
+    seed_fund_cash
+)
+from scripts.portfolio import ensure_position_watermark
+from scripts.snapshots import ensure_snapshot_history
+
+# khoá advisory: 2 lần migrate đồng thời không chạy đè nhau
+_MIGRATE_LOCK = "schema_migrate"
+
+
+def migrate(engine) -> dict:
+    """
+    Toàn bộ schema pipeline trong 1 transaction; lỗi giữa chừng thì rollback
+    hết, không để schema dở dang.
+    """
+    from scripts.db import install_nav_pipeline
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:lock))"),
+            {"lock": _MIGRATE_LOCK}
+        )
+
+        ensure_fund_columns(conn)
+        ensure_portfolio_fund_key(conn)
+        ensure_fund_units(conn)
+        ensure_fee_schedule(conn)
+        ensure_snapshot_history(conn)
+        ensure_position_watermark(conn)
+        ensure_corporate_actions_table(conn)
+        install_nav_pipeline(conn)
+
+        funds = known_funds(conn)
+
+        return {
+            "funds": funds,
+            "cash_rows_seeded": seed_fund_cash(conn, funds),
+            "fund_units_seeded": seed_fund_units(conn, funds),
+        }
+
+
+if __name__ == "__main__":
+    from scripts.db_engine import get_engine
+
+    print(migrate(get_engine()))
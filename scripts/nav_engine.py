@@ -0,0 +1,400 @@
+import datetime
+import json
+import uuid
+
+import pandas as pd
+from sqlalchemy import text
+
+from scripts.fund_units import get_outstanding_units
+from scripts.fees import DEFAULT_FEE_RATES, fee_rates_for_dates, load_fee_schedule
+from scripts.funds import DEFAULT_FUND
+
+# ==============================
+# CONFIG
+# ==============================
+# rate mặc định khi không truyền biểu phí (xem fee_schedule)
+MANAGEMENT_FEE_RATE = DEFAULT_FEE_RATES["management_fee"]
+TRANSACTION_FEE_RATE = DEFAULT_FEE_RATES["transaction_fee"]
+
+# namespace advisory lock cho NAV; key = nav_date.toordinal()
+# (mỗi quỹ 1 namespace riêng: hashtext('4242:<fund>'))
+NAV_LOCK_NAMESPACE = 4242
+
+# key 0 (không trùng ordinal ngày nào): khoá cả quỹ. fn_run_nav giữ shared,
+# recompute_nav_range giữ exclusive -> không chạy song song với run daily
+NAV_FUND_LOCK_KEY = 0
+
+
+# ==============================
+# 1️⃣ LOAD INPUTS
+# ==============================
+def load_nav_inputs(
+    conn,
+    start: datetime.date,
+    end: datetime.date,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Đọc mọi dữ liệu của 1 quỹ cần để dựng lại NAV cho [start, end] trong vài query:
+      - portfolio hiện tại (điểm neo để roll ngược)
+      - trades / fundshare_trades từ start trở đi
+      - price_history trong khoảng + giá gần nhất trước start
+      - tổng units hiện tại (aggregate fund_units)
+    """
+    portfolio = pd.read_sql(
+        text("""
+            SELECT UPPER(ticker) AS ticker, asset_type,
+                   quantity, market_price, net_value
+            FROM portfolio
+            WHERE fund = :fund
+        """),
+        conn,
+        params={"fund": fund}
+    )
+
+    trades = pd.read_sql(
+        text("""
+            SELECT
+                CAST(trade_date AS DATE) AS trade_date,
+                UPPER(ticker) AS ticker,
+                CASE WHEN side = 'Buy' THEN quantity ELSE -quantity END AS qty,
+                cash_flow
+            FROM trades
+            WHERE is_processed = TRUE
+              AND fund = :fund
+              AND CAST(trade_date AS DATE) > :start
+        """),
+        conn,
+        params={"start": start, "fund": fund}
+    )
+
+    fundshare = pd.read_sql(
+        text("""
+            SELECT
+                CAST(trade_date AS DATE) AS trade_date,
+                CASE WHEN side = 'BUY' THEN quantity ELSE -quantity END AS qty,
+                cash_flow
+            FROM fundshare_trades
+            WHERE status = 'SUCCESS'
+              AND fund = :fund
+              AND CAST(trade_date AS DATE) >= :start
+        """),
+        conn,
+        params={"start": start, "fund": fund}
+    )
+
+    prices = pd.read_sql(
+        text("""
+            (
+                SELECT ticker, price_date, close_price
+                FROM price_history
+                WHERE price_date BETWEEN :start AND :end
+            )
+            UNION ALL
+            (
+                SELECT DISTINCT ON (ticker) ticker, price_date, close_price
+                FROM price_history
+                WHERE price_date < :start
+                ORDER BY ticker, price_date DESC
+            )
+        """),
+        conn,
+        params={"start": start, "end": end}
+    )
+
+    units_now = get_outstanding_units(conn, fund)
+
+    return {
+        "portfolio": portfolio,
+        "trades": trades,
+        "fundshare": fundshare,
+        "prices": prices,
+        "units_now": units_now,
+    }
+
+
+# ==============================
+# 2️⃣ COMPUTE (VECTORIZED)
+# ==============================
+def _after(daily: pd.DataFrame | pd.Series, dates: pd.DatetimeIndex):
+    """
+    Tổng các giá trị có ngày > d, cho mọi d trong dates.
+    """
+    daily = daily.reindex(dates.union(daily.index), fill_value=0).sort_index()
+    total = daily.sum()
+    upto = daily.cumsum().reindex(dates)
+    return total - upto
+
+
+def compute_nav_frame(
+    inputs: dict,
+    start: datetime.date,
+    end: datetime.date,
+    management_fee_rate: float | pd.Series = MANAGEMENT_FEE_RATE,
+    transaction_fee_rate: float | pd.Series = TRANSACTION_FEE_RATE
+) -> pd.DataFrame:
+    """
+    NAV theo ngày cho [start, end], 1 lượt pandas.
+    Rate phí là số hoặc Series theo ngày (fee_rates_for_dates).
+
+    Vị thế và cash ngày d = hiện tại trừ mọi giao dịch sau d.
+    Giá = price_history as-of d, fallback market_price hiện tại.
+    """
+    dates = pd.date_range(start, end, freq="D")
+
+    portfolio = inputs["portfolio"]
+    is_cash = portfolio["asset_type"] == "Cash"
+
+    holdings = portfolio[~is_cash].groupby("ticker").agg(
+        quantity=("quantity", "sum"),
+        market_price=("market_price", "last"),
+    ).astype(float)
+    cash_now = float(portfolio.loc[is_cash, "net_value"].astype(float).sum())
+
+    # ===== Quantity theo ngày =====
+    trades = inputs["trades"].copy()
+    trades["trade_date"] = pd.to_datetime(trades["trade_date"])
+    tickers = holdings.index.union(pd.Index(trades["ticker"].unique()))
+
+    qty_daily = trades.pivot_table(
+        index="trade_date", columns="ticker", values="qty",
+        aggfunc="sum", fill_value=0
+    ).reindex(columns=tickers, fill_value=0).astype(float)
+
+    qty_now = holdings["quantity"].reindex(tickers, fill_value=0)
+    qty = qty_now - _after(qty_daily, dates)
+
+    # ===== Giá as-of theo ngày =====
+    prices = inputs["prices"].copy()
+    prices["price_date"] = pd.to_datetime(prices["price_date"])
+    price_wide = prices.pivot_table(
+        index="price_date", columns="ticker", values="close_price", aggfunc="last"
+    ).astype(float)
+    price_wide = (
+        price_wide.reindex(price_wide.index.union(dates))
+        .sort_index()
+        .ffill()
+        .reindex(index=dates, columns=tickers)
+    )
+    fallback = holdings["market_price"].reindex(tickers)
+    price_wide = price_wide.fillna(fallback)
+
+    assets_value = (qty * price_wide).fillna(0).sum(axis=1)
+
+    # ===== Cash theo ngày =====
+    fundshare = inputs["fundshare"].copy()
+    fundshare["trade_date"] = pd.to_datetime(fundshare["trade_date"])
+
+    cash_daily = pd.concat([
+        trades.groupby("trade_date")["cash_flow"].sum(),
+        fundshare.groupby("trade_date")["cash_flow"].sum(),
+    ]).astype(float).groupby(level=0).sum()
+    cash = cash_now - _after(cash_daily, dates)
+
+    # ===== Units + phí =====
+    units_daily = fundshare.groupby("trade_date")["qty"].sum().astype(float)
+    units = inputs["units_now"] - _after(units_daily, dates)
+
+    traded = (
+        fundshare["cash_flow"].astype(float).abs()
+        .groupby(fundshare["trade_date"]).sum()
+        .reindex(dates, fill_value=0)
+    )
+
+    # số hoặc Series theo ngày -> Series theo dates
+    mgmt_rate = pd.Series(management_fee_rate, index=dates, dtype=float)
+    txn_rate = pd.Series(transaction_fee_rate, index=dates, dtype=float)
+
+    nav_gross = assets_value + cash
+    management_fee = nav_gross * mgmt_rate / 365
+    transaction_fee = traded * txn_rate
+    total_cost = management_fee + transaction_fee
+    nav_net = nav_gross - total_cost
+
+    df = pd.DataFrame({
+        "nav_date": dates.date,
+        "nav_gross": nav_gross.to_numpy(),
+        "management_fee": management_fee.to_numpy(),
+        "transaction_fee": transaction_fee.to_numpy(),
+        "total_cost": total_cost.to_numpy(),
+        "nav_net": nav_net.to_numpy(),
+        "units": units.to_numpy(),
+        "management_fee_rate": mgmt_rate.to_numpy(),
+        "transaction_fee_rate": txn_rate.to_numpy(),
+    })
+    df["nav_per_unit"] = df["nav_net"] / df["units"].where(df["units"] > 0)
+
+    return df
+
+
+# ==============================
+# 3️⃣ WRITE (BULK)
+# ==============================
+def write_nav_range(
+    conn,
+    df: pd.DataFrame,
+    start,
+    end,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Thay nav + costs của quỹ trong [start, end] bằng df, số statement cố định.
+    """
+    params = {
+        "start": start,
+        "end": end,
+        "dates": list(df["nav_date"]),
+        "nav": [float(x) for x in df["nav_net"]],
+        "units": [float(x) for x in df["units"]],
+        "ppu": [float(x) for x in df["nav_per_unit"]],
+        "mgmt": [float(x) for x in df["management_fee"]],
+        "txn": [float(x) for x in df["transaction_fee"]],
+        "mgmt_rate": [float(x) for x in df["management_fee_rate"]],
+        "txn_rate": [float(x) for x in df["transaction_fee_rate"]],
+        "fund": fund,
+    }
+
+    conn.execute(text("""
+        DELETE FROM nav
+        WHERE fund = :fund
+          AND nav_date BETWEEN :start AND :end
+    """), params)
+
+    nav_rows = conn.execute(text("""
+        INSERT INTO nav (nav_date, nav_total, current_units, nav_per_unit, fund)
+        SELECT *, :fund
+        FROM unnest(
+            CAST(:dates AS date[]),
+            CAST(:nav AS numeric[]),
+            CAST(:units AS numeric[]),
+            CAST(:ppu AS numeric[])
+        )
+    """), params).rowcount
+
+    conn.execute(text("""
+        DELETE FROM costs
+        WHERE fund = :fund
+          AND cost_date BETWEEN :start AND :end
+    """), params)
+
+    cost_rows = conn.execute(text("""
+        INSERT INTO costs (cost_date, cost_type, cost, cost_category, rate, fund)
+        SELECT d, 'management_fee', m, 'Management', r, :fund
+        FROM unnest(
+            CAST(:dates AS date[]),
+            CAST(:mgmt AS numeric[]),
+            CAST(:mgmt_rate AS numeric[])
+        ) AS v(d, m, r)
+        UNION ALL
+        SELECT d, 'transaction_fee', t, 'Trading', r, :fund
+        FROM unnest(
+            CAST(:dates AS date[]),
+            CAST(:txn AS numeric[]),
+            CAST(:txn_rate AS numeric[])
+        ) AS v(d, t, r)
+    """), params).rowcount
+
+    return {"nav": nav_rows, "costs": cost_rows}
+
+
+def record_nav_range_runs(
+    conn,
+    df: pd.DataFrame,
+    start,
+    end,
+    fund: str = DEFAULT_FUND
+) -> int:
+    """
+    Ledger nav_runs cho [start, end] sau khi dựng lại: run SUCCESS cũ chuyển
+    SUPERSEDED, mỗi ngày dựng lại 1 run SUCCESS mới mang kết quả mới, để
+    run_nav_pipeline sau đó không trả lại kết quả cũ ("reused").
+    """
+    conn.execute(text("""
+        UPDATE nav_runs
+        SET status = 'SUPERSEDED'
+        WHERE fund = :fund
+          AND nav_date BETWEEN :start AND :end
+          AND status = 'SUCCESS'
+    """), {"fund": fund, "start": start, "end": end})
+
+    if df.empty:
+        return 0
+
+    results = [
+        json.dumps({
+            "nav_gross": float(r.nav_gross),
+            "total_cost": float(r.total_cost),
+            "nav_net": float(r.nav_net),
+            "units": float(r.units),
+            "nav_per_unit": float(r.nav_per_unit),
+        })
+        for r in df.itertuples(index=False)
+    ]
+
+    return conn.execute(text("""
+        INSERT INTO nav_runs (
+            run_id, nav_date, status, finished_at, result, steps, fund
+        )
+        SELECT
+            v.run_id, v.nav_date, 'SUCCESS', now(), v.result,
+            jsonb_build_array(jsonb_build_object(
+                'step', 'recompute_nav_range', 'rows', 1, 'ms', NULL
+            )),
+            :fund
+        FROM unnest(
+            CAST(:run_ids AS uuid[]),
+            CAST(:dates AS date[]),
+            CAST(:results AS jsonb[])
+        ) AS v(run_id, nav_date, result)
+    """), {
+        "run_ids": [str(uuid.uuid4()) for _ in results],
+        "dates": list(df["nav_date"]),
+        "results": results,
+        "fund": fund,
+    }).rowcount
+
+
+def recompute_nav_range(
+    engine,
+    start: datetime.date,
+    end: datetime.date,
+    fund: str = DEFAULT_FUND
+) -> dict:
+    """
+    Dựng lại nav + costs của quỹ cho [start, end] trong 1 lượt vector hoá.
+    Các ngày units <= 0 (trước khi quỹ có CCQ) bị bỏ qua. Giữ khoá NAV của
+    quỹ suốt transaction và cập nhật ledger nav_runs của khoảng ngày.
+    """
+    if start > end:
+        raise ValueError("start must be <= end")
+
+    with engine.begin() as conn:
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:ns), :key)"),
+            {"ns": f"{NAV_LOCK_NAMESPACE}:{fund}", "key": NAV_FUND_LOCK_KEY}
+        )
+
+        inputs = load_nav_inputs(conn, start, end, fund)
+
+        schedule = load_fee_schedule(conn, fund)
+        dates = pd.date_range(start, end, freq="D")
+
+        df = compute_nav_frame(
+            inputs,
+            start,
+            end,
+            fee_rates_for_dates(schedule, "management_fee", dates),
+            fee_rates_for_dates(schedule, "transaction_fee", dates),
+        )
+
+        skipped = [d for d in df.loc[df["units"] <= 0, "nav_date"]]
+        df = df[df["units"] > 0]
+
+        rows = write_nav_range(conn, df, start, end, fund=fund)
+        rows["nav_runs"] = record_nav_range_runs(conn, df, start, end, fund=fund)
+
+    return {
+        "days": len(df),
+        "skipped": skipped,
+        "rows": rows,
+    }
@@ -3,6 +3,7 @@ import os
 from sqlalchemy import text
 from datetime import date
 from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND
 def build_trade_record(ticker, side, quantity, price, trade_date):
     side = side.capitalize()
 
@@ -21,14 +22,161 @@ def build_trade_record(ticker, side, quantity, price, trade_date):
         "price": price,
         "cash_flow": cash_flow
     }
-from sqlalchemy import text
+# ==============================
+# CONFIG
+# ==============================
+# số trade tối đa áp vào portfolio trong 1 transaction
+POSITION_CHUNK_SIZE = 1000
 
+POSITION_WATERMARK_DDL = """
+CREATE TABLE IF NOT EXISTS position_watermark (
+    fund          TEXT PRIMARY KEY,
+    last_trade_id BIGINT NOT NULL,
+    updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
 
-def update_portfolio(engine):
+-- trade chưa xử lý nằm dưới watermark (commit muộn hơn trade id lớn hơn)
+CREATE INDEX IF NOT EXISTS trades_unprocessed_idx
+    ON trades (fund, trade_id)
+    WHERE is_processed = FALSE;
+"""
 
-    with engine.begin() as conn:
 
-        # 1️⃣ Insert ticker mới nếu chưa có
+# ==============================
+# 1️⃣ WATERMARK
+# ==============================
+def ensure_position_watermark(conn):
+    """
+    Tạo bảng position_watermark + partial index trade chưa xử lý (DDL: chỉ
+    gọi từ scripts.migrate).
+    """
+    conn.execute(text(POSITION_WATERMARK_DDL))
+
+
+def seed_position_watermark(conn, fund: str = DEFAULT_FUND):
+    """
+    Seed watermark của quỹ 1 lần: ngay trước trade chưa xử lý đầu tiên,
+    hoặc trade cuối cùng.
+    """
+    conn.execute(
+        text("""
+            INSERT INTO position_watermark (fund, last_trade_id)
+            SELECT :fund, COALESCE(
+                (
+                    SELECT MIN(trade_id) - 1
+                    FROM trades
+                    WHERE fund = :fund
+                      AND is_processed = FALSE
+                ),
+                (
+                    SELECT MAX(trade_id)
+                    FROM trades
+                    WHERE fund = :fund
+                ),
+                0
+            )
+            WHERE NOT EXISTS (
+                SELECT 1 FROM position_watermark WHERE fund = :fund
+            )
+            ON CONFLICT (fund) DO NOTHING
+        """),
+        {"fund": fund}
+    )
+
+
+def pending_trade_count(conn, fund: str = DEFAULT_FUND) -> int:
+    """
+    Số trade sau watermark (range scan theo trade_id) + trade chưa xử lý
+    nằm dưới watermark (partial index).
+    """
+    seed_position_watermark(conn, fund)
+
+    return conn.execute(
+        text("""
+            SELECT
+                (
+                    SELECT COUNT(*)
+                    FROM trades t
+                    WHERE t.fund = :fund
+                      AND t.trade_id > w.last_trade_id
+                )
+                + (
+                    SELECT COUNT(*)
+                    FROM trades t
+                    WHERE t.fund = :fund
+                      AND t.trade_id <= w.last_trade_id
+                      AND t.is_processed = FALSE
+                )
+            FROM position_watermark w
+            WHERE w.fund = :fund
+        """),
+        {"fund": fund}
+    ).scalar()
+
+
+# ==============================
+# 2️⃣ ÁP 1 CHUNK TRADE
+# ==============================
+def _apply_trade_chunk(conn, fund: str, chunk_size: int) -> dict:
+    """
+    Áp tối đa chunk_size trade: trước hết các trade chưa xử lý nằm dưới
+    watermark (id cấp trước nhưng commit sau lượt trước), rồi các trade
+    kế tiếp sau watermark; chỉ đụng các ticker có trong chunk + dòng Cash,
+    rồi đẩy watermark. scanned = 0: hết trade.
+    """
+    params = {"fund": fund}
+
+    # khoá dòng watermark: 2 lượt update song song không áp trùng trade
+    hwm = conn.execute(
+        text("""
+            SELECT last_trade_id
+            FROM position_watermark
+            WHERE fund = :fund
+            FOR UPDATE
+        """),
+        params
+    ).scalar()
+
+    late = conn.execute(
+        text("""
+            SELECT trade_id
+            FROM trades
+            WHERE fund = :fund
+              AND trade_id <= :hwm
+              AND is_processed = FALSE
+            ORDER BY trade_id
+            LIMIT :n
+        """),
+        {**params, "hwm": hwm, "n": chunk_size}
+    ).scalars().all()
+
+    chunk = []
+
+    if len(late) < chunk_size:
+        chunk = conn.execute(
+            text("""
+                SELECT trade_id, is_processed
+                FROM trades
+                WHERE fund = :fund
+                  AND trade_id > :hwm
+                ORDER BY trade_id
+                LIMIT :n
+            """),
+            {**params, "hwm": hwm, "n": chunk_size - len(late)}
+        ).all()
+
+    if not late and not chunk:
+        return {"scanned": 0, "trades": 0, "tickers": 0, "watermark": hwm}
+
+    # trade đã is_processed (luồng cũ) chỉ được vượt qua, không áp lại
+    params["ids"] = list(late) + [r.trade_id for r in chunk if not r.is_processed]
+    # watermark chỉ tiến, không lùi về các trade đến muộn
+    params["hwm"] = chunk[-1].trade_id if chunk else hwm
+
+    tickers = 0
+
+    if params["ids"]:
+        # ticker mới
         conn.execute(text("""
             INSERT INTO portfolio (
                 ticker,
@@ -39,7 +187,8 @@ def update_portfolio(engine):
                 market_price,
                 net_value,
                 interest,
-                price_date
+                price_date,
+                fund
             )
             SELECT DISTINCT
                 t.ticker,
@@ -50,14 +199,15 @@ def update_portfolio(engine):
                 0,
                 0,
                 0,
-                CURRENT_DATE
+                CURRENT_DATE,
+                :fund
             FROM trades t
-            WHERE t.is_processed = FALSE
-            ON CONFLICT (ticker) DO NOTHING;
-        """))
+            WHERE t.trade_id = ANY(:ids)
+            ON CONFLICT (fund, ticker) DO NOTHING;
+        """), params)
 
-        # 2️⃣ Update positions
-        conn.execute(text("""
+        # vị thế của các ticker trong chunk
+        tickers = conn.execute(text("""
         WITH trade_agg AS (
 
             SELECT
@@ -85,12 +235,10 @@ def update_portfolio(engine):
                         THEN quantity * price
                         ELSE 0
                     END
-                ) AS buy_value,
-
-                SUM(cash_flow) AS total_cash
+                ) AS buy_value
 
             FROM trades
-            WHERE is_processed = FALSE
+            WHERE trade_id = ANY(:ids)
             GROUP BY ticker
         ),
 
@@ -99,8 +247,6 @@ def update_portfolio(engine):
             SELECT
                 p.ticker,
 
-                p.quantity AS old_qty,
-
                 (p.quantity + ta.buy_qty - ta.sell_qty) AS quantity_new,
 
                 CASE
@@ -115,6 +261,7 @@ def update_portfolio(engine):
             FROM portfolio p
             JOIN trade_agg ta
             ON p.ticker = ta.ticker
+            WHERE p.fund = :fund
         )
 
         UPDATE portfolio p
@@ -148,60 +295,175 @@ def update_portfolio(engine):
                 END
 
         FROM updated u
-        WHERE p.ticker = u.ticker;
-        """))
+        WHERE p.ticker = u.ticker
+          AND p.fund = :fund;
+        """), params).rowcount
 
-        # 3️⃣ Update Cash
+        # Cash
         conn.execute(text("""
             UPDATE portfolio
             SET net_value = net_value + sub.total_cash
             FROM (
                 SELECT COALESCE(SUM(cash_flow),0) AS total_cash
                 FROM trades
-                WHERE is_processed = FALSE
+                WHERE trade_id = ANY(:ids)
             ) sub
-            WHERE asset_type = 'Cash';
-        """))
+            WHERE asset_type = 'Cash'
+              AND fund = :fund;
+        """), params)
 
-        # 4️⃣ Mark processed
+        # giữ cờ is_processed cho các chỗ khác còn đọc
         conn.execute(text("""
             UPDATE trades
             SET is_processed = TRUE
-            WHERE is_processed = FALSE;
-        """))
-        # 5️⃣ Cleanup: xóa các stock có quantity = 0 và market_price = 0
+            WHERE trade_id = ANY(:ids);
+        """), params)
+
+        # Cleanup: chỉ các stock vừa đụng có quantity = 0 và market_price = 0
         conn.execute(text("""
             DELETE FROM portfolio
-            WHERE quantity = 0
+            WHERE fund = :fund
+            AND quantity = 0
             AND asset_type = 'Stock'
             AND market_price = 0
-        """))
-        # 6️⃣ Recalculate net_value
-        conn.execute(text("""
-            UPDATE portfolio
-            SET net_value = CASE
-                WHEN ticker = 'YTM' THEN net_value
-                ELSE COALESCE(quantity, 0) * COALESCE(market_price, 0)
-            END;
-        """))
-        
-        # 7️⃣ Sync YTM market_price = net_value
-        conn.execute(text("""
-            UPDATE portfolio
-            SET market_price = net_value
-            WHERE ticker = 'YTM';
-        """))
-        # 6️⃣ Recalculate current weight
-        conn.execute(text("""
-            WITH total_nav AS (
-                SELECT COALESCE(SUM(net_value), 0) AS total_value
-                FROM portfolio
+            AND ticker IN (
+                SELECT ticker FROM trades WHERE trade_id = ANY(:ids)
             )
-            UPDATE portfolio p
-            SET current_weight = CASE
-                WHEN t.total_value = 0 THEN 0
-                ELSE COALESCE(p.net_value, 0) / t.total_value
-            END
-            FROM total_nav t;
-        """))
-    return "Portfolio updated safely."
+        """), params)
+
+    conn.execute(text("""
+        UPDATE position_watermark
+        SET last_trade_id = :hwm,
+            updated_at = now()
+        WHERE fund = :fund
+    """), params)
+
+    return {
+        "scanned": len(late) + len(chunk),
+        "trades": len(params["ids"]),
+        "tickers": tickers,
+        "watermark": params["hwm"],
+    }
+
+
+# ==============================
+# 3️⃣ NET VALUE + WEIGHT (1 STATEMENT)
+# ==============================
+def refresh_weights(conn, fund: str = DEFAULT_FUND) -> int:
+    """
+    net_value theo giá hiện tại, sync YTM market_price = net_value và
+    current_weight (window SUM) trong 1 UPDATE; chỉ ghi dòng có thay đổi.
+    """
+    return conn.execute(text("""
+        WITH valued AS (
+            SELECT
+                ticker,
+                CASE
+                    WHEN ticker = 'YTM' THEN net_value
+                    ELSE COALESCE(quantity, 0) * COALESCE(market_price, 0)
+                END AS net_value_new
+            FROM portfolio
+            WHERE fund = :fund
+        ),
+
+        weighted AS (
+            SELECT
+                ticker,
+                net_value_new,
+                COALESCE(
+                    COALESCE(net_value_new, 0)
+                    / NULLIF(SUM(COALESCE(net_value_new, 0)) OVER (), 0),
+                    0
+                ) AS weight_new
+            FROM valued
+        )
+
+        UPDATE portfolio p
+        SET
+            net_value = w.net_value_new,
+            market_price = CASE
+                WHEN p.ticker = 'YTM' THEN w.net_value_new
+                ELSE p.market_price
+            END,
+            current_weight = w.weight_new
+        FROM weighted w
+        WHERE p.ticker = w.ticker
+          AND p.fund = :fund
+          AND (
+              p.net_value IS DISTINCT FROM w.net_value_new
+              OR p.current_weight IS DISTINCT FROM w.weight_new
+              OR (p.ticker = 'YTM' AND p.market_price IS DISTINCT FROM w.net_value_new)
+          );
+    """), {"fund": fund}).rowcount
+
+
+# ==============================
+# 4️⃣ UPDATE PORTFOLIO
+# ==============================
+def update_portfolio(
+    engine,
+    fund: str = DEFAULT_FUND,
+    chunk_size: int = POSITION_CHUNK_SIZE,
+    progress=None
+) -> dict:
+    """
+    Áp các trade sau watermark vào portfolio theo từng chunk (mỗi chunk 1
+    transaction, lỗi giữa chừng giữ nguyên các chunk đã xong), rồi tính lại
+    net_value / weight. progress(done, total) được gọi sau mỗi chunk.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be > 0")
+
+    with engine.begin() as conn:
+        total = pending_trade_count(conn, fund)
+
+    done = 0
+    applied = 0
+    chunks = 0
+    tickers = 0
+
+    while True:
+        with engine.begin() as conn:
+            result = _apply_trade_chunk(conn, fund, chunk_size)
+
+        watermark = result["watermark"]
+
+        if not result["scanned"]:
+            break
+
+        chunks += 1
+        done += result["scanned"]
+        applied += result["trades"]
+        tickers += result["tickers"]
+
+        if progress is not None:
+            # trade mới đến giữa chừng: total tăng theo
+            total = max(total, done)
+            progress(done, total)
+
+    with engine.begin() as conn:
+        rows = refresh_weights(conn, fund)
+
+    return {
+        "trades": applied,
+        "chunks": chunks,
+        "tickers": tickers,
+        "watermark": watermark,
+        "rows_revalued": rows,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply pending trades to portfolio")
+    parser.add_argument("--fund", default=DEFAULT_FUND)
+    parser.add_argument("--chunk-size", type=int, default=POSITION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    print(update_portfolio(
+        get_engine(),
+        fund=args.fund,
+        chunk_size=args.chunk_size,
+        progress=lambda done, total: print(f"{done}/{total} trades"),
+    ))
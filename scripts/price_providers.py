@@ -0,0 +1,214 @@
+import datetime
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+# ==============================
+# 1️⃣ INTERFACE
+# ==============================
+class PriceProvider:
+    """
+    Nguồn giá cho pipeline refresh. Mỗi provider trả về dict giống
+    pricing_yahoo.get_close_price (ticker, close_price, market_date, updated_at).
+    """
+
+    name = "base"
+
+    # Chỉ cache local (quote_cache) cho nguồn giá thật
+    cacheable = False
+
+    # số mã mỗi lời gọi get_close_prices trong fetch_prices (1 = từng mã)
+    batch_size = 1
+
+    # get_close_prices gọi song song được (False: các lô chạy tuần tự)
+    batch_threadsafe = True
+
+    # chuỗi giá trả về đã điều chỉnh split / cổ tức CP (backfill không áp lại)
+    split_adjusted = False
+
+    def get_close_price(self, ticker: str, timeout: float = 10) -> dict:
+        raise NotImplementedError
+
+    def get_price_series(
+        self,
+        ticker: str,
+        start: datetime.date | None = None,
+        timeout: float = 10
+    ) -> list:
+        raise NotImplementedError
+
+    def get_close_prices(self, tickers, timeout: float = 10, raise_errors: bool = False):
+        """
+        Lấy giá theo lô, trả về (prices, failures). Mặc định gọi từng mã;
+        provider có API lô (Yahoo) override lại. raise_errors: lỗi mạng
+        (không phải ValueError) được raise để caller retry cả lô.
+        """
+        prices = []
+        failures = {}
+
+        for t in tickers:
+            try:
+                prices.append(self.get_close_price(t, timeout))
+            except ValueError as e:
+                failures[t] = str(e)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                failures[t] = str(e)
+
+        return prices, failures
+
+
+def _series_to_prices(ticker: str, closes: pd.Series, start=None) -> list:
+    return [
+        {
+            "ticker": ticker,
+            "close_price": float(close),
+            "market_date": idx.date(),
+        }
+        for idx, close in closes.dropna().items()
+        if start is None or idx.date() >= start
+    ]
+
+
+def _last_price(ticker: str, series: list) -> dict:
+    if not series:
+        raise ValueError(f"No data for {ticker}")
+
+    last = series[-1]
+
+    return {
+        **last,
+        "updated_at": datetime.date.today()
+    }
+
+
+# ==============================
+# 2️⃣ FIXTURE (CSV / PARQUET)
+# ==============================
+class FixturePriceProvider(PriceProvider):
+    """
+    Giá đọc từ file cố định, cột: ticker, date, close.
+    Dùng cho test / benchmark offline, kết quả xác định.
+    """
+
+    name = "fixture"
+
+    def __init__(self, path: str):
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path)
+
+        df["ticker"] = df["ticker"].str.upper().str.replace(".VN", "", regex=False)
+        df["date"] = pd.to_datetime(df["date"])
+        df = df.sort_values(["ticker", "date"])
+
+        self._series = {
+            t: g.set_index("date")["close"]
+            for t, g in df.groupby("ticker")
+        }
+
+    def tickers(self) -> list:
+        return list(self._series)
+
+    def get_price_series(self, ticker, start=None, timeout=10):
+        closes = self._series.get(ticker)
+
+        if closes is None:
+            raise ValueError(f"No data for {ticker}")
+
+        return _series_to_prices(ticker, closes, start)
+
+    def get_close_price(self, ticker, timeout=10):
+        return _last_price(ticker, self.get_price_series(ticker))
+
+
+# ==============================
+# 3️⃣ SYNTHETIC RANDOM WALK
+# ==============================
+class RandomWalkPriceProvider(PriceProvider):
+    """
+    Chuỗi giá ngẫu nhiên (geometric random walk) theo ngày làm việc.
+    Seed theo ticker nên cùng mã luôn ra cùng chuỗi; dùng cho load test
+    hàng nghìn mã.
+    """
+
+    name = "random_walk"
+
+    def __init__(
+        self,
+        days: int = 500,
+        start_price: float = 20_000,
+        volatility: float = 0.02,
+        seed: int = 0,
+        end: datetime.date | None = None
+    ):
+        self.days = days
+        self.start_price = start_price
+        self.volatility = volatility
+        self.seed = seed
+        self.end = end or datetime.date.today()
+
+    def _closes(self, ticker: str) -> pd.Series:
+        rng = np.random.default_rng(self.seed + zlib.crc32(ticker.encode()))
+        returns = rng.normal(0, self.volatility, self.days)
+        closes = self.start_price * np.exp(np.cumsum(returns))
+
+        index = pd.bdate_range(end=self.end, periods=self.days)
+
+        return pd.Series(np.round(closes, -1), index=index)
+
+    def get_price_series(self, ticker, start=None, timeout=10):
+        return _series_to_prices(ticker, self._closes(ticker), start)
+
+    def get_close_price(self, ticker, timeout=10):
+        return _last_price(ticker, self.get_price_series(ticker))
+
+
+# ==============================
+# 4️⃣ BENCHMARK (OFFLINE)
+# ==============================
+def benchmark_fetch(provider: PriceProvider, tickers, **kwargs) -> dict:
+    """
+    Đo throughput phase fetch (không DB) của pipeline giá.
+    """
+    from scripts.pricing_yahoo import fetch_prices
+
+    n_tickers = len(tickers)
+
+    t0 = time.perf_counter()
+    prices, failures, skipped = fetch_prices(tickers, provider=provider, **kwargs)
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "provider": provider.name,
+        "tickers": n_tickers,
+        "ok": len(prices),
+        "failed": len(failures),
+        "skipped": len(skipped),
+        "seconds": elapsed,
+        "tickers_per_sec": n_tickers / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline price fetch benchmark")
+    parser.add_argument("--tickers", type=int, default=1000)
+    parser.add_argument("--fixture", default=None, help="CSV/Parquet fixture file")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.fixture:
+        provider = FixturePriceProvider(args.fixture)
+        tickers = provider.tickers()
+    else:
+        provider = RandomWalkPriceProvider()
+        tickers = [f"T{i:05d}" for i in range(args.tickers)]
+
+    print(benchmark_fetch(provider, tickers, max_workers=args.workers))
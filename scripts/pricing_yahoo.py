@@ -1,17 +1,26 @@
-import yfinance as yf
 from sqlalchemy import text
 import datetime
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from scripts.quote_cache import get_fresh_quotes, put_quotes
+from scripts.price_providers import PriceProvider
+
+# yfinance (kéo theo requests/pandas/curl_cffi) chỉ import khi thực sự gọi
+# Yahoo, để page import module này không trả giá import lúc khởi động.
 
 # ==============================
 # 1️⃣ LẤY GIÁ
 # ==============================
-def get_close_price(ticker: str) -> dict:
-    ticker_clean = ticker.upper().replace(".VN", "")
-    yf_ticker = f"{ticker_clean}.VN"
+def _normalize_ticker(ticker: str) -> str:
+    return ticker.upper().replace(".VN", "")
 
-    data = yf.Ticker(yf_ticker).history(period="1mo", auto_adjust=False)
 
-    if data.empty:
+def _last_close(data, ticker_clean: str) -> dict:
+    if data is None or data.empty:
         raise ValueError(f"No data for {ticker_clean}")
 
     data = data[["Close"]].dropna()
@@ -32,6 +41,349 @@ def get_close_price(ticker: str) -> dict:
         "updated_at": updated_at
     }
 
+
+def get_close_price(ticker: str, timeout: float = 10) -> dict:
+    import yfinance as yf
+
+    ticker_clean = _normalize_ticker(ticker)
+    yf_ticker = f"{ticker_clean}.VN"
+
+    data = yf.Ticker(yf_ticker).history(
+        period="1mo",
+        auto_adjust=False,
+        timeout=timeout
+    )
+
+    return _last_close(data, ticker_clean)
+
+
+# ==============================
+# 1️⃣b LẤY GIÁ THEO LÔ (BATCH)
+# ==============================
+BATCH_CHUNK_SIZE = 25
+
+# lỗi trong yf.shared._ERRORS mang các chuỗi này là lỗi vĩnh viễn (mã không
+# tồn tại / không có giá); mọi lỗi khác (rate limit, timeout, mạng) là tạm thời
+PERMANENT_ERROR_MARKERS = (
+    "delisted",
+    "no timezone found",
+    "no data found",
+    "no price data found",
+    "symbol may be",
+    "not found",
+)
+
+
+class TransientFetchError(RuntimeError):
+    """
+    Lỗi tạm thời của provider (throttle, timeout, mạng): được retry với
+    backoff và tính vào circuit breaker.
+    """
+
+
+def _is_permanent_error(message: str) -> bool:
+    message = str(message).lower()
+    return any(m in message for m in PERMANENT_ERROR_MARKERS)
+
+
+def get_close_prices(
+    tickers,
+    chunk_size: int = BATCH_CHUNK_SIZE,
+    timeout: float = 10,
+    raise_errors: bool = False
+):
+    """
+    Tải giá nhiều mã trong vài request yf.download (mỗi chunk 1 request).
+    Trả về (prices, failures):
+      - prices: list dict giống get_close_price
+      - failures: {ticker: lỗi} cho từng mã lỗi
+    raise_errors: lỗi request của 1 chunk, kể cả lỗi tạm thời yf.download
+    tự nuốt (TransientFetchError), được raise (để retry) thay vì ghi vào
+    failures cho các mã của chunk.
+    """
+    import yfinance as yf
+
+    tickers_clean = list(dict.fromkeys(_normalize_ticker(t) for t in tickers))
+
+    prices = []
+    failures = {}
+
+    for start in range(0, len(tickers_clean), chunk_size):
+        chunk = tickers_clean[start:start + chunk_size]
+        yf_tickers = [f"{t}.VN" for t in chunk]
+
+        try:
+            data = yf.download(
+                yf_tickers,
+                period="1mo",
+                auto_adjust=False,
+                group_by="ticker",
+                multi_level_index=True,
+                threads=True,
+                progress=False,
+                timeout=timeout,
+            )
+        except Exception as e:
+            if raise_errors:
+                raise
+            for t in chunk:
+                failures[t] = str(e)
+            continue
+
+        # yf.download tự bắt lỗi HTTP / throttle từng mã, ghi vào
+        # yf.shared._ERRORS và trả cột rỗng thay vì raise
+        errors = {
+            _normalize_ticker(k): str(v)
+            for k, v in (getattr(yf.shared, "_ERRORS", None) or {}).items()
+        }
+        transient = {
+            t: e for t, e in errors.items()
+            if t in chunk and not _is_permanent_error(e)
+        }
+
+        # cả chunk rỗng mà không phải mọi mã đều lỗi vĩnh viễn: coi là throttle
+        if (data is None or data.empty) and not all(
+            _is_permanent_error(errors.get(t, "")) for t in chunk
+        ):
+            transient = {
+                t: errors.get(t, "Empty response") for t in chunk
+                if not _is_permanent_error(errors.get(t, ""))
+            }
+
+        if transient:
+            if raise_errors:
+                raise TransientFetchError(
+                    f"{len(transient)}/{len(chunk)} tickers failed: "
+                    + "; ".join(f"{t}: {e}" for t, e in list(transient.items())[:3])
+                )
+            failures.update(transient)
+
+        for t, yf_t in zip(chunk, yf_tickers):
+            if t in transient:
+                continue
+
+            try:
+                if data is None or data.empty:
+                    raise ValueError(f"No data for {t}")
+
+                if data.columns.nlevels == 1:
+                    # yfinance cũ trả cột phẳng cho chunk 1 mã
+                    if len(chunk) != 1:
+                        raise ValueError(f"No data for {t}")
+                    frame = data
+                elif yf_t in data.columns.get_level_values(0):
+                    frame = data[yf_t]
+                else:
+                    raise ValueError(f"No data for {t}")
+
+                prices.append(_last_close(frame, t))
+
+            except Exception as e:
+                failures[t] = str(e)
+
+    return prices, failures
+
+# ==============================
+# 1️⃣c RETRY / CIRCUIT BREAKER
+# ==============================
+FETCH_MAX_WORKERS = 8
+FETCH_TIMEOUT = 10
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Mở mạch sau `threshold` lỗi liên tiếp; trong `cooldown` giây mọi lời gọi
+    fail ngay. Hết cooldown cho thử lại 1 lần (half-open).
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # half-open: 1 lỗi nữa là mở lại
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(provider_name: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        if provider_name not in _BREAKERS:
+            _BREAKERS[provider_name] = CircuitBreaker()
+        return _BREAKERS[provider_name]
+
+
+def _call_with_retries(
+    fn,
+    ticker: str,
+    breaker: CircuitBreaker,
+    attempts: int = RETRY_ATTEMPTS,
+    base_delay: float = RETRY_BASE_DELAY,
+    max_delay: float = RETRY_MAX_DELAY
+):
+    """
+    Gọi fn(ticker), retry lỗi mạng / TransientFetchError với exponential
+    backoff + full jitter. ValueError (mã không tồn tại, không có giá) là
+    lỗi vĩnh viễn: không retry, không tính vào circuit breaker.
+    """
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit open, skipped")
+
+        try:
+            result = fn(ticker)
+        except ValueError:
+            breaker.record_success()
+            raise
+        except Exception:
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+        else:
+            breaker.record_success()
+            return result
+
+
+def _task_budget(timeout: float, attempts: int = RETRY_ATTEMPTS) -> float:
+    # thời gian tối đa cho 1 mã: mọi lần thử + mọi lần chờ backoff
+    return attempts * timeout + (attempts - 1) * RETRY_MAX_DELAY
+
+
+# ==============================
+# 1️⃣d LẤY GIÁ SONG SONG (KHÔNG GIỮ KẾT NỐI DB)
+# ==============================
+def fetch_prices(
+    tickers,
+    max_workers: int = FETCH_MAX_WORKERS,
+    timeout: float = FETCH_TIMEOUT,
+    provider: PriceProvider | None = None
+):
+    """
+    Phase 1 của refresh giá, không mở kết nối DB. Mã được chia lô
+    provider.batch_size, mỗi lô 1 lời gọi get_close_prices có
+    timeout + retry/backoff; pool giới hạn max_workers.
+
+    yf.download dùng state toàn cục (batch_threadsafe = False) nên các lô
+    Yahoo chạy tuần tự: 1 request cho mỗi BATCH_CHUNK_SIZE mã.
+
+    Trả về (prices, failures, skipped); skipped là các mã bị bỏ qua
+    do circuit breaker đang mở.
+    """
+    provider = provider or YahooPriceProvider()
+    breaker = get_breaker(provider.name)
+    tickers_clean = list(dict.fromkeys(_normalize_ticker(t) for t in tickers))
+
+    if provider.batch_size <= 1:
+        return _run_pool(
+            lambda t: _call_with_retries(
+                lambda x: provider.get_close_price(x, timeout), t, breaker
+            ),
+            tickers_clean,
+            max_workers,
+            _task_budget(timeout)
+        )
+
+    chunks = [
+        tuple(tickers_clean[i:i + provider.batch_size])
+        for i in range(0, len(tickers_clean), provider.batch_size)
+    ]
+
+    results, chunk_failures, chunk_skipped = _run_pool(
+        lambda c: _call_with_retries(
+            lambda x: provider.get_close_prices(x, timeout=timeout, raise_errors=True),
+            c,
+            breaker
+        ),
+        chunks,
+        max_workers if provider.batch_threadsafe else 1,
+        _task_budget(timeout)
+    )
+
+    prices = [p for chunk_prices, _ in results for p in chunk_prices]
+    failures = {t: e for _, chunk_fail in results for t, e in chunk_fail.items()}
+
+    for chunk, err in chunk_failures.items():
+        failures.update(dict.fromkeys(chunk, err))
+
+    skipped = [t for chunk in chunk_skipped for t in chunk]
+
+    return prices, failures, skipped
+
+
+def _run_pool(fn, tickers, max_workers: int, timeout: float):
+    """
+    Chạy fn(ticker) trên pool giới hạn, deadline theo số đợt worker.
+    Trả về (results, failures, skipped).
+    """
+    results = []
+    failures = {}
+    skipped = []
+
+    if not tickers:
+        return results, failures, skipped
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(fn, t): t for t in tickers}
+
+    # Deadline tổng: số "đợt" worker * thời gian tối đa mỗi mã
+    rounds = -(-len(tickers) // max_workers)
+    done, not_done = wait(futures, timeout=rounds * timeout + timeout)
+
+    for fut in done:
+        t = futures[fut]
+        try:
+            results.append(fut.result())
+        except CircuitOpenError:
+            skipped.append(t)
+        except Exception as e:
+            failures[t] = str(e)
+
+    for fut in not_done:
+        failures[futures[fut]] = f"Timed out after {timeout}s"
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return results, failures, skipped
+
+
 # ==============================
 # 2️⃣ LẤY DANH SÁCH STOCK
 # ==============================
@@ -51,62 +403,320 @@ def get_stock_tickers(engine):
 # ==============================
 # 3️⃣ UPDATE ALL
 # ==============================
-def update_all_prices(engine):
+def _upsert_price_history(conn, prices, source: str = "yfinance") -> int:
+    """
+    Upsert list dict (ticker, close_price, market_date) vào price_history
+    bằng 1 statement INSERT ... SELECT FROM unnest.
+    """
+    result = conn.execute(
+        text("""
+            INSERT INTO price_history (
+                ticker,
+                close_price,
+                price_date,
+                source,
+                created_at
+            )
+            SELECT
+                v.ticker,
+                v.close_price,
+                v.market_date,
+                :source,
+                now()
+            FROM unnest(
+                CAST(:tickers AS text[]),
+                CAST(:close_prices AS numeric[]),
+                CAST(:market_dates AS date[])
+            ) AS v(ticker, close_price, market_date)
+            ON CONFLICT (ticker, price_date)
+            DO UPDATE SET
+                close_price = EXCLUDED.close_price,
+                source = EXCLUDED.source,
+                created_at = now();
+        """),
+        {
+            "tickers": [p["ticker"] for p in prices],
+            "close_prices": [p["close_price"] for p in prices],
+            "market_dates": [p["market_date"] for p in prices],
+            "source": source,
+        }
+    )
+    return result.rowcount
+
+
+def write_prices(engine, prices, source: str = "yfinance") -> dict:
+    """
+    Phase 2 của refresh giá: ghi toàn bộ giá trong 1 transaction ngắn,
+    số statement cố định (2) bất kể số mã, truyền dữ liệu qua unnest(array).
+
+    Trả về số dòng bị ảnh hưởng theo bảng.
+    """
+    rows = {"price_history": 0, "portfolio": 0}
+
+    if not prices:
+        return rows
+
+    params = {
+        "tickers": [p["ticker"] for p in prices],
+        "close_prices": [p["close_price"] for p in prices],
+        "updated_ats": [p["updated_at"] for p in prices],
+    }
+
+    with engine.begin() as conn:
+        # Lưu lịch sử giá theo ngày thị trường
+        rows["price_history"] = _upsert_price_history(conn, prices, source)
+
+        # Update portfolio theo ngày hệ thống
+        result = conn.execute(
+            text("""
+                UPDATE portfolio p
+                SET
+                    market_price = v.close_price,
+                    price_date   = v.updated_at
+                FROM unnest(
+                    CAST(:tickers AS text[]),
+                    CAST(:close_prices AS numeric[]),
+                    CAST(:updated_ats AS date[])
+                ) AS v(ticker, close_price, updated_at)
+                WHERE UPPER(p.ticker) = v.ticker
+                  AND p.asset_type = 'Stock';
+            """),
+            params
+        )
+        rows["portfolio"] = result.rowcount
+
+    return rows
+
+
+@dataclass
+class PriceRefreshResult:
+    succeeded: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    skipped: list = field(default_factory=list)
+    cached: list = field(default_factory=list)
+    rows: dict = field(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return len(self.succeeded)
+
+
+def update_all_prices(
+    engine,
+    use_cache: bool = True,
+    provider: PriceProvider | None = None
+) -> PriceRefreshResult:
+    provider = provider or YahooPriceProvider()
     tickers = get_stock_tickers(engine)
 
     if not tickers:
         print("No stock tickers found.")
-        return 0
+        return PriceRefreshResult()
 
-    count = 0
+    # Phase 0: cache local, mã còn hạn không gọi provider
+    if use_cache and provider.cacheable:
+        cached, stale = get_fresh_quotes(tickers)
+    else:
+        cached, stale = [], tickers
 
-    with engine.begin() as conn:
-        for ticker in tickers:
-            try:
-                price = get_close_price(ticker)
-
-                # Lưu lịch sử giá theo ngày thị trường
-                conn.execute(
-                    text("""
-                        INSERT INTO price_history (
-                            ticker,
-                            close_price,
-                            price_date,
-                            source,
-                            created_at
-                        )
-                        VALUES (
-                            :ticker,
-                            :close_price,
-                            :market_date,
-                            'yfinance',
-                            now()
-                        )
-                        ON CONFLICT (ticker, price_date)
-                        DO UPDATE SET
-                            close_price = EXCLUDED.close_price,
-                            source = EXCLUDED.source,
-                            created_at = now();
-                    """),
-                    price
-                )
+    # Phase 1: network, không giữ transaction
+    fetched, failures, skipped = (
+        fetch_prices(stale, provider=provider) if stale else ([], {}, [])
+    )
 
-                # Update portfolio theo ngày hệ thống
-                conn.execute(
-                    text("""
-                        UPDATE portfolio
-                        SET
-                            market_price = :close_price,
-                            price_date   = :updated_at
-                        WHERE UPPER(ticker) = :ticker
-                          AND asset_type = 'Stock';
-                    """),
-                    price
-                )
+    for ticker, err in failures.items():
+        print(f"[WARN] {ticker}: {err}")
 
-                count += 1
+    if skipped:
+        print(f"[WARN] circuit open, skipped {len(skipped)} tickers")
 
-            except Exception as e:
-                print(f"[WARN] {ticker}: {e}")
+    prices = cached + fetched
+
+    # Phase 2: ghi DB. Quote trong cache đã được ghi ở lượt fetch trước:
+    # toàn cache hit thì không ghi lại giá y hệt
+    if fetched:
+        rows = write_prices(engine, prices, provider.name)
+
+        # chỉ cache sau khi ghi thành công: quote trong cache luôn đã có trong DB
+        if provider.cacheable:
+            put_quotes(fetched)
+    else:
+        rows = {"price_history": 0, "portfolio": 0}
+
+    print(
+        f"[INFO] cache hits: {len(cached)}, fetched: {len(fetched)}, "
+        f"price_history: {rows['price_history']} rows, "
+        f"portfolio: {rows['portfolio']} rows"
+    )
+
+    return PriceRefreshResult(
+        succeeded=[p["ticker"] for p in prices],
+        failed=failures,
+        skipped=skipped,
+        cached=[p["ticker"] for p in cached],
+        rows=rows
+    )
+
+
+# ==============================
+# 4️⃣ BACKFILL LỊCH SỬ GIÁ (INCREMENTAL)
+# ==============================
+BACKFILL_DEFAULT_PERIOD = "2y"
+
+
+def get_latest_price_dates(engine, tickers) -> dict:
+    """
+    {ticker: price_date mới nhất trong price_history} (None nếu chưa có).
+    """
+    with engine.connect() as conn:
+        result = conn.execute(
+            text("""
+                SELECT
+                    t.ticker,
+                    MAX(ph.price_date) AS last_date
+                FROM unnest(CAST(:tickers AS text[])) AS t(ticker)
+                LEFT JOIN price_history ph
+                  ON ph.ticker = t.ticker
+                GROUP BY t.ticker
+            """),
+            {"tickers": list(tickers)}
+        )
+        return {row[0]: row[1] for row in result}
+
+
+def get_price_series(
+    ticker: str,
+    start: datetime.date | None = None,
+    timeout: float = FETCH_TIMEOUT
+) -> list:
+    """
+    Toàn bộ giá đóng cửa ngày từ start (hoặc BACKFILL_DEFAULT_PERIOD) tới nay.
+    """
+    import yfinance as yf
+
+    ticker_clean = _normalize_ticker(ticker)
+    yf_ticker = f"{ticker_clean}.VN"
+
+    if start is None:
+        data = yf.Ticker(yf_ticker).history(
+            period=BACKFILL_DEFAULT_PERIOD,
+            auto_adjust=False,
+            timeout=timeout
+        )
+    else:
+        data = yf.Ticker(yf_ticker).history(
+            start=start,
+            end=datetime.date.today() + datetime.timedelta(days=1),
+            auto_adjust=False,
+            timeout=timeout
+        )
+
+    if data is None or data.empty:
+        return []
+
+    data = data[["Close"]].dropna()
+
+    return [
+        {
+            "ticker": ticker_clean,
+            "close_price": float(close),
+            "market_date": idx.date(),
+        }
+        for idx, close in data["Close"].items()
+        if start is None or idx.date() >= start
+    ]
+
+
+def backfill_price_history(
+    engine,
+    max_workers: int = FETCH_MAX_WORKERS,
+    timeout: float = FETCH_TIMEOUT,
+    provider: PriceProvider | None = None
+) -> dict:
+    """
+    Với mỗi mã: tìm price_date mới nhất đã lưu, chỉ tải các ngày còn thiếu,
+    rồi bulk insert toàn bộ chuỗi giá ngày trong 1 transaction.
+    """
+    provider = provider or YahooPriceProvider()
+    tickers = get_stock_tickers(engine)
+
+    if not tickers:
+        print("No stock tickers found.")
+        return {"tickers": 0, "rows": 0, "failures": {}, "skipped": []}
+
+    last_dates = get_latest_price_dates(engine, tickers)
+    today = datetime.date.today()
+
+    todo = {}
+    for t in tickers:
+        last = last_dates.get(t)
+        start = None if last is None else last + datetime.timedelta(days=1)
+
+        if start is not None and start > today:
+            continue
+
+        todo[t] = start
+
+    # Network: không giữ kết nối DB
+    breaker = get_breaker(provider.name)
+    series, failures, skipped = _run_pool(
+        lambda t: _call_with_retries(
+            lambda x: provider.get_price_series(x, todo[x], timeout), t, breaker
+        ),
+        list(todo),
+        max_workers,
+        _task_budget(timeout)
+    )
+
+    for ticker, err in failures.items():
+        print(f"[WARN] {ticker}: {err}")
+
+    prices = [p for s in series for p in s]
+
+    # Chuỗi chưa điều chỉnh: áp các corporate action đã applied để khớp dữ
+    # liệu đã điều chỉnh trong DB. Close của Yahoo (kể cả auto_adjust=False)
+    # đã điều chỉnh split nên không áp lại.
+    if prices and not provider.split_adjusted:
+        import pandas as pd
+        from scripts.corporate_actions import adjust_prices_frame, load_corporate_actions
+
+        actions = load_corporate_actions(engine, applied=True)
+        prices = adjust_prices_frame(pd.DataFrame(prices), actions).to_dict("records")
+
+    rows = 0
+    if prices:
+        with engine.begin() as conn:
+            rows = _upsert_price_history(conn, prices, provider.name)
+
+    print(f"[INFO] backfill: {len(todo)} tickers, {rows} rows")
+
+    return {
+        "tickers": len(todo),
+        "rows": rows,
+        "failures": failures,
+        "skipped": skipped
+    }
+
+
+# ==============================
+# 5️⃣ YAHOO PROVIDER
+# ==============================
+class YahooPriceProvider(PriceProvider):
+    """
+    Provider mặc định: yfinance, mã sàn HOSE hậu tố .VN.
+    """
+
+    name = "yfinance"
+    cacheable = True
+    batch_size = BATCH_CHUNK_SIZE
+    batch_threadsafe = False
+    split_adjusted = True
+
+    def get_close_price(self, ticker, timeout=FETCH_TIMEOUT):
+        return get_close_price(ticker, timeout)
+
+    def get_price_series(self, ticker, start=None, timeout=FETCH_TIMEOUT):
+        return get_price_series(ticker, start, timeout)
 
-    return count
+    def get_close_prices(self, tickers, timeout=FETCH_TIMEOUT, raise_errors=False):
+        return get_close_prices(tickers, timeout=timeout, raise_errors=raise_errors)
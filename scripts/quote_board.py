@@ -0,0 +1,160 @@
+import datetime
+import threading
+
+import streamlit as st
+
+from scripts.quote_cache import HOSE_TZ, is_session_open, session_closed_today
+
+# ==============================
+# CONFIG
+# ==============================
+POLL_INTERVAL = 60
+POLL_TIMEOUT = 10
+
+
+# ==============================
+# 1️⃣ QUOTE BOARD (IN-MEMORY)
+# ==============================
+class QuoteBoard:
+    """
+    Bảng giá intraday dùng chung mọi session. Mỗi lần quote đổi giá thì
+    version tăng; page chỉ lấy các quote có version > version đã thấy.
+    Không ghi DB cho tới khi commit_end_of_day (sau ATC).
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.polled_at = None
+        self.last_error = None
+        self._quotes = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def apply(self, prices) -> list:
+        """
+        Ghi quote mới vào board, trả về list mã đổi giá.
+        """
+        changed = []
+
+        with self._lock:
+            for p in prices:
+                old = self._quotes.get(p["ticker"])
+
+                if old is not None and old["close_price"] == p["close_price"]:
+                    continue
+
+                self.version += 1
+                self._quotes[p["ticker"]] = {**p, "version": self.version}
+                changed.append(p["ticker"])
+
+            self.polled_at = datetime.datetime.now(HOSE_TZ)
+
+        return changed
+
+    def changes_since(self, version: int):
+        """
+        (quote đổi sau `version`, version hiện tại).
+        """
+        with self._lock:
+            changed = [
+                dict(q) for q in self._quotes.values()
+                if q["version"] > version
+            ]
+            return changed, self.version
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [dict(q) for q in self._quotes.values()]
+
+    # ==============================
+    # 2️⃣ POLLER
+    # ==============================
+    def _fetch(self, engine, provider) -> list:
+        from scripts.pricing_yahoo import get_stock_tickers
+
+        tickers = get_stock_tickers(engine)
+
+        prices, failures = provider.get_close_prices(tickers, timeout=POLL_TIMEOUT)
+
+        self.last_error = (
+            f"{len(failures)} tickers failed" if failures else None
+        )
+
+        return prices
+
+    def poll_once(self, engine, provider=None) -> list:
+        from scripts.pricing_yahoo import YahooPriceProvider
+
+        provider = provider or YahooPriceProvider()
+
+        return self.apply(self._fetch(engine, provider))
+
+    def _run(self, engine, provider, interval: float, market_hours_only: bool):
+        while not self._stop.is_set():
+            if not market_hours_only or is_session_open():
+                try:
+                    self.poll_once(engine, provider)
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"[WARN] quote board poll: {e}")
+
+            self._stop.wait(interval)
+
+    def start(
+        self,
+        engine,
+        provider=None,
+        interval: float = POLL_INTERVAL,
+        market_hours_only: bool = True
+    ):
+        if self.running:
+            return
+
+        # poller cũ (đã stop) có thể còn đang giữa 1 lượt poll: chờ nó thoát
+        # trước khi clear cờ stop, tránh 2 poller chạy song song
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(engine, provider, interval, market_hours_only),
+            name="quote-board-poller",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    # ==============================
+    # 3️⃣ END-OF-DAY COMMIT
+    # ==============================
+    def commit_end_of_day(self, engine, provider=None) -> dict:
+        """
+        Sau ATC: poll lại 1 lượt để lấy giá đóng cửa, ghi vào price_history +
+        portfolio trong 1 transaction. Quote intraday (poll dừng lúc 14:45)
+        không bao giờ được ghi làm giá đóng cửa, và không seed quote cache
+        (update_all_prices vẫn lấy giá đóng cửa chính thức).
+        """
+        from scripts.pricing_yahoo import YahooPriceProvider, write_prices
+
+        if not session_closed_today():
+            raise RuntimeError("End-of-day commit is only allowed after today's close")
+
+        provider = provider or YahooPriceProvider()
+
+        prices = self._fetch(engine, provider)
+        self.apply(prices)
+
+        return write_prices(engine, prices, provider.name)
+
+
+@st.cache_resource
+def get_quote_board() -> QuoteBoard:
+    return QuoteBoard()
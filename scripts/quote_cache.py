@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import datetime
+from zoneinfo import ZoneInfo
+
+# ==============================
+# CONFIG
+# ==============================
+CACHE_PATH = os.getenv(
+    "QUOTE_CACHE_PATH",
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ".cache",
+        "quotes.sqlite"
+    )
+)
+
+# HOSE: phiên chiều kết thúc (ATC) lúc 14:45, giờ Việt Nam
+HOSE_TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+HOSE_CLOSE = datetime.time(14, 45)
+HOSE_SESSIONS = (
+    (datetime.time(9, 0), datetime.time(11, 30)),
+    (datetime.time(13, 0), HOSE_CLOSE),
+)
+
+# ngày nghỉ lễ cố định theo dương lịch (1/1, 30/4, 1/5, 2/9)
+HOSE_FIXED_HOLIDAYS = ((1, 1), (4, 30), (5, 1), (9, 2))
+
+# Tết âm lịch, Giỗ Tổ, ngày nghỉ bù: HOSE công bố theo từng năm, cấu hình
+# qua HOSE_HOLIDAYS="2026-02-16,2026-02-17,..." (ISO, cách nhau dấu phẩy)
+HOSE_HOLIDAYS = frozenset(
+    datetime.date.fromisoformat(d.strip())
+    for d in os.getenv("HOSE_HOLIDAYS", "").split(",")
+    if d.strip()
+)
+
+
+# ==============================
+# 1️⃣ LỊCH PHIÊN HOSE
+# ==============================
+def is_trading_day(day: datetime.date) -> bool:
+    """
+    T2–T6, không phải ngày lễ (cố định + HOSE_HOLIDAYS).
+    """
+    return (
+        day.weekday() < 5
+        and (day.month, day.day) not in HOSE_FIXED_HOLIDAYS
+        and day not in HOSE_HOLIDAYS
+    )
+
+
+def last_session_close(now: datetime.datetime | None = None) -> datetime.datetime:
+    """
+    Thời điểm đóng cửa phiên HOSE gần nhất <= now (bỏ qua T7, CN, ngày lễ).
+    """
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+    else:
+        now = now.astimezone(HOSE_TZ)
+
+    day = now.date()
+    if now.time() < HOSE_CLOSE:
+        day -= datetime.timedelta(days=1)
+
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+
+    return datetime.datetime.combine(day, HOSE_CLOSE, tzinfo=HOSE_TZ)
+
+
+def next_session_close(now: datetime.datetime | None = None) -> datetime.datetime:
+    """
+    Thời điểm đóng cửa phiên HOSE kế tiếp > now (bỏ qua T7, CN, ngày lễ).
+    """
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+    else:
+        now = now.astimezone(HOSE_TZ)
+
+    day = now.date()
+    if now.time() >= HOSE_CLOSE:
+        day += datetime.timedelta(days=1)
+
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+
+    return datetime.datetime.combine(day, HOSE_CLOSE, tzinfo=HOSE_TZ)
+
+
+def is_session_open(now: datetime.datetime | None = None) -> bool:
+    """
+    Đang trong giờ khớp lệnh HOSE (sáng / chiều, ngày giao dịch).
+    """
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+    else:
+        now = now.astimezone(HOSE_TZ)
+
+    if not is_trading_day(now.date()):
+        return False
+
+    return any(start <= now.time() < end for start, end in HOSE_SESSIONS)
+
+
+def session_closed_today(now: datetime.datetime | None = None) -> bool:
+    """
+    Hôm nay là ngày giao dịch và phiên đã đóng cửa (sau ATC).
+    """
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+    else:
+        now = now.astimezone(HOSE_TZ)
+
+    return last_session_close(now).date() == now.date()
+
+
+def is_fresh(fetched_at: datetime.datetime, now: datetime.datetime | None = None) -> bool:
+    """
+    Freshness policy: không refetch cho tới khi có phiên đóng cửa mới
+    sau lần lấy giá gần nhất.
+    """
+    return fetched_at >= last_session_close(now)
+
+
+# ==============================
+# 2️⃣ SQLITE STORE
+# ==============================
+def _connect(path: str = CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS quotes (
+            ticker      TEXT NOT NULL,
+            market_date TEXT NOT NULL,
+            close_price REAL NOT NULL,
+            fetched_at  TEXT NOT NULL,
+            PRIMARY KEY (ticker, market_date)
+        )
+    """)
+    return conn
+
+
+def get_fresh_quotes(tickers, now: datetime.datetime | None = None, path: str = CACHE_PATH):
+    """
+    Trả về (fresh, stale):
+      - fresh: list dict giống get_close_price cho các mã còn hạn
+      - stale: list mã cần tải lại
+    """
+    tickers = list(dict.fromkeys(tickers))
+
+    if not tickers:
+        return [], []
+
+    placeholders = ",".join("?" for _ in tickers)
+
+    with _connect(path) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT q.ticker, q.market_date, q.close_price, q.fetched_at
+            FROM quotes q
+            WHERE q.ticker IN ({placeholders})
+              AND q.market_date = (
+                  SELECT MAX(market_date)
+                  FROM quotes
+                  WHERE ticker = q.ticker
+              )
+            """,
+            tickers
+        ).fetchall()
+    conn.close()
+
+    today = datetime.date.today()
+    fresh = []
+    fresh_tickers = set()
+
+    for ticker, market_date, close_price, fetched_at in rows:
+        if not is_fresh(datetime.datetime.fromisoformat(fetched_at), now):
+            continue
+
+        fresh.append({
+            "ticker": ticker,
+            "close_price": close_price,
+            "market_date": datetime.date.fromisoformat(market_date),
+            "updated_at": today
+        })
+        fresh_tickers.add(ticker)
+
+    stale = [t for t in tickers if t not in fresh_tickers]
+
+    return fresh, stale
+
+
+def put_quotes(prices, now: datetime.datetime | None = None, path: str = CACHE_PATH):
+    if not prices:
+        return
+
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+
+    with _connect(path) as conn:
+        conn.executemany(
+            """
+            INSERT INTO quotes (ticker, market_date, close_price, fetched_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (ticker, market_date)
+            DO UPDATE SET
+                close_price = excluded.close_price,
+                fetched_at  = excluded.fetched_at
+            """,
+            [
+                (
+                    p["ticker"],
+                    p["market_date"].isoformat(),
+                    float(p["close_price"]),
+                    now.isoformat()
+                )
+                for p in prices
+            ]
+        )
+    conn.close()
@@ -0,0 +1,335 @@
+"""
+Lịch sử overall snapshot (append-only, phân vùng theo tháng) + retention:
+  - intraday: mọi snapshot, giữ INTRADAY_RETENTION
+  - daily: snapshot cuối mỗi ngày của từng quỹ, giữ vĩnh viễn
+Dashboard tính snapshot trong bộ nhớ (compute_overall_snapshot); bảng lịch
+sử chỉ để audit / vẽ chuỗi, view overall_snapshot_latest là bộ ghi gần nhất.
+
+Đường ghi snapshot chỉ INSERT; partition tháng được tạo trước (migrate +
+bảo trì), retention chạy trong bảo trì (CLI này hoặc daemon update_prices).
+
+    python -m scripts.snapshots        # partition trước + retention
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from scripts.funds import DEFAULT_FUND
+from scripts.quote_cache import HOSE_TZ
+
+# ==============================
+# CONFIG
+# ==============================
+INTRADAY_RETENTION = datetime.timedelta(days=7)
+
+# số tháng tới được tạo sẵn partition (ngoài tháng hiện tại)
+PARTITION_MONTHS_AHEAD = 3
+
+SNAPSHOT_TIERS = ("intraday", "daily")
+
+# loại tài sản có dòng riêng trong snapshot (ngoài Total)
+SNAPSHOT_ASSET_TYPES = ("Stock", "Bond", "Fund share", "Cash")
+
+SNAPSHOT_HISTORY_DDL = """
+CREATE TABLE IF NOT EXISTS overall_snapshot_history (
+    attribute          TEXT NOT NULL,
+    initial_investment NUMERIC,
+    market_value       NUMERIC,
+    profit             NUMERIC,
+    interest           NUMERIC,
+    weight             NUMERIC,
+    weight_obj         NUMERIC,
+    snapshot_time      TIMESTAMPTZ NOT NULL,
+    fund               TEXT NOT NULL,
+    tier               TEXT NOT NULL DEFAULT 'intraday'
+) PARTITION BY RANGE (snapshot_time);
+
+CREATE TABLE IF NOT EXISTS overall_snapshot_history_default
+    PARTITION OF overall_snapshot_history DEFAULT;
+
+CREATE INDEX IF NOT EXISTS overall_snapshot_history_fund_time_idx
+    ON overall_snapshot_history (fund, snapshot_time);
+
+CREATE INDEX IF NOT EXISTS overall_snapshot_history_tier_idx
+    ON overall_snapshot_history (tier, snapshot_time);
+
+-- con trỏ tới bộ snapshot mới nhất của mỗi quỹ
+CREATE TABLE IF NOT EXISTS overall_snapshot_head (
+    fund          TEXT PRIMARY KEY,
+    snapshot_time TIMESTAMPTZ NOT NULL
+);
+
+CREATE OR REPLACE VIEW overall_snapshot_latest AS
+SELECT
+    h.attribute,
+    h.initial_investment,
+    h.market_value,
+    h.weight,
+    h.weight_obj,
+    h.profit,
+    h.interest,
+    h.snapshot_time,
+    h.fund
+FROM overall_snapshot_head p
+JOIN overall_snapshot_history h
+  ON h.fund = p.fund
+ AND h.snapshot_time = p.snapshot_time;
+"""
+
+# khoá DDL (nhiều worker process cùng tạo partition)
+_DDL_LOCK = "overall_snapshot_history"
+
+
+# ==============================
+# 1️⃣ SCHEMA
+# ==============================
+def ensure_snapshot_partitions(conn, source: str = "SELECT now()"):
+    """
+    Tạo partition tháng cho mọi tháng có trong `source` (1 cột timestamptz;
+    mặc định: tháng hiện tại theo giờ DB). Dòng của tháng đó đã rơi vào
+    partition DEFAULT được chuyển sang partition mới trước khi attach.
+    """
+    months = conn.execute(text(f"""
+        SELECT DISTINCT CAST(date_trunc('month', ts) AS DATE)
+        FROM ({source}) AS s(ts)
+        WHERE ts IS NOT NULL
+    """)).scalars().all()
+
+    for start in months:
+        name = f"overall_snapshot_history_{start:%Y%m}"
+
+        if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar():
+            continue
+
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:lock))"),
+            {"lock": _DDL_LOCK}
+        )
+
+        if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar():
+            continue
+
+        # CREATE ... PARTITION OF lỗi nếu DEFAULT đã có dòng trong khoảng:
+        # tạo bảng rời, chuyển dòng từ DEFAULT sang, rồi attach
+        conn.execute(text(f"""
+            CREATE TABLE {name}
+                (LIKE overall_snapshot_history INCLUDING DEFAULTS);
+
+            WITH moved AS (
+                DELETE FROM overall_snapshot_history_default
+                WHERE snapshot_time >= '{start}'
+                  AND snapshot_time < '{end}'
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved;
+
+            ALTER TABLE overall_snapshot_history
+                ATTACH PARTITION {name}
+                FOR VALUES FROM ('{start}') TO ('{end}');
+        """))
+
+
+def precreate_snapshot_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """
+    Partition cho tháng hiện tại + months_ahead tháng tới (migrate / bảo trì).
+    """
+    ensure_snapshot_partitions(conn, f"""
+        SELECT generate_series(
+            date_trunc('month', now()),
+            date_trunc('month', now()) + INTERVAL '{int(months_ahead)} months',
+            INTERVAL '1 month'
+        )
+    """)
+
+
+def ensure_snapshot_history(conn):
+    """
+    Tạo bảng lịch sử + view latest (DDL: chỉ gọi từ scripts.migrate). Lần
+    đầu chép bảng overall_snapshot cũ vào lịch sử (tier daily).
+    """
+    conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:lock))"),
+        {"lock": _DDL_LOCK}
+    )
+    conn.execute(text(SNAPSHOT_HISTORY_DDL))
+
+    # partition cho các tháng của dữ liệu cũ trước khi chép (không rơi vào default)
+    ensure_snapshot_partitions(conn, """
+        SELECT snapshot_time FROM overall_snapshot
+        WHERE NOT EXISTS (SELECT 1 FROM overall_snapshot_history)
+    """)
+
+    copied = conn.execute(text("""
+        INSERT INTO overall_snapshot_history (
+            attribute, initial_investment, market_value, profit,
+            interest, weight, weight_obj, snapshot_time, fund, tier
+        )
+        SELECT
+            attribute, initial_investment, market_value, profit,
+            interest, weight, weight_obj, snapshot_time, fund, 'daily'
+        FROM overall_snapshot
+        WHERE snapshot_time IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM overall_snapshot_history)
+    """)).rowcount
+
+    if copied:
+        conn.execute(text("""
+            INSERT INTO overall_snapshot_head (fund, snapshot_time)
+            SELECT fund, MAX(snapshot_time)
+            FROM overall_snapshot_history
+            GROUP BY fund
+            ON CONFLICT (fund) DO NOTHING
+        """))
+
+    precreate_snapshot_partitions(conn)
+
+
+# ==============================
+# 2️⃣ TÍNH SNAPSHOT (PANDAS, KHÔNG GHI DB)
+# ==============================
+def compute_overall_snapshot(
+    portfolio: pd.DataFrame,
+    snapshot_time: datetime.datetime | None = None
+) -> pd.DataFrame:
+    """
+    Cùng các dòng Total / loại tài sản / Cash như update_overall_snapshot,
+    tính từ DataFrame portfolio đã cache trong 1 groupby.
+    """
+    columns = [
+        "attribute", "initial_investment", "market_value",
+        "profit", "interest", "weight", "snapshot_time",
+    ]
+
+    if portfolio.empty:
+        return pd.DataFrame(columns=columns)
+
+    is_cash = (portfolio["asset_type"] == "Cash").to_numpy()
+
+    qty = pd.to_numeric(portfolio["quantity"], errors="coerce").fillna(0).to_numpy(float)
+    buy = pd.to_numeric(portfolio["buy_price"], errors="coerce").fillna(0).to_numpy(float)
+    mkt = pd.to_numeric(portfolio["market_price"], errors="coerce").fillna(0).to_numpy(float)
+    net = pd.to_numeric(portfolio["net_value"], errors="coerce").fillna(0).to_numpy(float)
+
+    rows = pd.DataFrame({
+        "asset_type": portfolio["asset_type"].to_numpy(),
+        "initial_investment": np.where(is_cash, net, buy * qty),
+        "market_value": np.where(is_cash, net, mkt * qty),
+        "profit": np.where(is_cash, 0.0, (mkt - buy) * qty),
+    })
+
+    by_type = rows.groupby("asset_type").sum()
+    total = by_type.sum()
+
+    df = by_type.reindex(
+        [t for t in SNAPSHOT_ASSET_TYPES if t in by_type.index]
+    )
+    df.loc["Total"] = total
+    df = df.reindex(["Total"] + list(df.index[:-1]))
+
+    total_market = total["market_value"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["interest"] = df["market_value"] / df["initial_investment"].replace(0, np.nan) - 1
+        df["weight"] = df["market_value"] / (total_market if total_market else np.nan)
+
+    if "Cash" in df.index:
+        df.loc["Cash", "interest"] = 0.0
+    df.loc["Total", "weight"] = 1.0
+
+    df["snapshot_time"] = snapshot_time or datetime.datetime.now(HOSE_TZ)
+
+    return df.rename_axis("attribute").reset_index()[columns]
+
+
+# ==============================
+# 3️⃣ RETENTION
+# ==============================
+def apply_snapshot_retention(conn, keep_intraday=INTRADAY_RETENTION) -> dict:
+    """
+    Nâng snapshot cuối mỗi ngày (trước hôm nay) lên tier daily, xoá các
+    snapshot intraday cũ hơn keep_intraday. Chỉ đụng dòng intraday.
+    """
+    promoted = conn.execute(text("""
+        WITH last_of_day AS (
+            SELECT fund, MAX(snapshot_time) AS snapshot_time
+            FROM overall_snapshot_history
+            WHERE tier = 'intraday'
+              AND snapshot_time < date_trunc('day', now())
+            GROUP BY fund, CAST(snapshot_time AS DATE)
+        )
+        UPDATE overall_snapshot_history h
+        SET tier = 'daily'
+        FROM last_of_day l
+        WHERE h.fund = l.fund
+          AND h.snapshot_time = l.snapshot_time
+          AND h.tier = 'intraday'
+    """)).rowcount
+
+    expired = conn.execute(
+        text("""
+            DELETE FROM overall_snapshot_history
+            WHERE tier = 'intraday'
+              AND snapshot_time < now() - CAST(:keep AS INTERVAL)
+        """),
+        {"keep": f"{int(keep_intraday.total_seconds())} seconds"}
+    ).rowcount
+
+    return {"promoted": promoted, "expired": expired}
+
+
+# ==============================
+# 4️⃣ SERIES (WEIGHT DRIFT)
+# ==============================
+def load_snapshot_series(
+    engine,
+    fund: str = DEFAULT_FUND,
+    start: datetime.date | None = None,
+    tier: str = "daily"
+) -> pd.DataFrame:
+    """
+    Chuỗi weight / market_value theo thời gian của từng attribute (gọn:
+    chỉ các cột cần vẽ), mặc định 1 điểm mỗi ngày.
+    """
+    if tier not in SNAPSHOT_TIERS:
+        raise ValueError(f"tier must be one of {SNAPSHOT_TIERS}")
+
+    with engine.connect() as conn:
+        df = pd.read_sql(
+            text("""
+                SELECT snapshot_time, attribute, weight, market_value
+                FROM overall_snapshot_history
+                WHERE fund = :fund
+                  AND tier = :tier
+                  AND (CAST(:start AS DATE) IS NULL OR snapshot_time >= CAST(:start AS DATE))
+                ORDER BY snapshot_time
+            """),
+            conn,
+            params={"fund": fund, "tier": tier, "start": start}
+        )
+
+    for col in ("weight", "market_value"):
+        df[col] = df[col].astype(float)
+
+    return df
+
+
+# ==============================
+# 5️⃣ BẢO TRÌ (NGOÀI REQUEST)
+# ==============================
+def run_snapshot_maintenance(engine) -> dict:
+    """
+    Tạo trước partition các tháng tới + retention, 1 transaction.
+    """
+    with engine.begin() as conn:
+        precreate_snapshot_partitions(conn)
+        return apply_snapshot_retention(conn)
+
+
+if __name__ == "__main__":
+    from scripts.db_engine import get_engine
+
+    print(run_snapshot_maintenance(get_engine()))
@@ -1,8 +1,9 @@
-import plotly.express as px
 import streamlit as st
 
 
 def render_asset_allocation(df):
+    import plotly.express as px
+
     st.subheader("Asset Allocation")
 
     df_pie = df[df["attribute"].isin(
@@ -1,6 +1,6 @@
-import plotly.graph_objects as go
-
 def render_nav_chart(df_nav):
+    import plotly.graph_objects as go
+
     df = df_nav.sort_values("nav_date")
 
     y_min = df["nav_per_unit"].min()
@@ -1,28 +1,149 @@
+import threading
+
+import numpy as np
 import pandas as pd
+import streamlit as st
 from scripts.db_engine import get_engine
+from scripts.funds import DEFAULT_FUND
 from sqlalchemy import text
 
-def get_nav_df():
+NAV_COLUMNS = ("nav_total", "current_units", "nav_per_unit")
+
+# updated_at được đóng dấu trước khi transaction ghi commit: đọc chồng lên
+# 1 khoảng để không lỡ dòng commit muộn hơn lần đọc trước
+NAV_REFRESH_OVERLAP = "10 minutes"
+
+
+class NavSeriesCache:
     """
-    Dùng cho UI: nav table, chart
+    Chuỗi NAV của 1 quỹ giữ dạng cột (numpy), dùng chung mọi session.
+    Mỗi lần đọc chỉ query các ngày có dòng ghi (nav.updated_at) hoặc bị xoá
+    (nav_tombstones) sau mốc đã thấy: ngày mới, NAV daily ghi lại, dựng
+    lại / xoá NAV lịch sử; các ngày đó được thay toàn bộ bằng bản mới.
     """
-    engine = get_engine()
 
-    with engine.connect() as conn:
-        df = pd.read_sql(
-            """
-            SELECT
-                nav_date,
-                nav_total,
-                current_units,
-                nav_per_unit
-            FROM nav
-            ORDER BY nav_date
-            """,
-            conn
+    def __init__(self, fund: str):
+        self.fund = fund
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.dates = np.empty(0, dtype="datetime64[D]")
+        self.values = {c: np.empty(0, dtype=float) for c in NAV_COLUMNS}
+        self.seen_at = None
+
+    def invalidate(self):
+        """
+        Bỏ toàn bộ cache (vd sau khi dựng lại NAV lịch sử); lần đọc sau
+        tải lại đủ.
+        """
+        with self._lock:
+            self._reset()
+
+    def _read_delta(self, conn, since):
+        """
+        Các ngày bị đụng sau since (None: cả chuỗi), mỗi ngày kèm các dòng
+        nav hiện có (không có dòng: ngày đã bị xoá) và mốc ghi / xoá.
+        """
+        return pd.read_sql(
+            text(f"""
+                WITH touched AS (
+                    SELECT nav_date, MAX(stamp) AS stamp
+                    FROM (
+                        SELECT nav_date, updated_at AS stamp
+                        FROM nav
+                        WHERE fund = :fund
+                          AND (
+                              CAST(:since AS TIMESTAMPTZ) IS NULL
+                              OR updated_at > CAST(:since AS TIMESTAMPTZ)
+                                  - INTERVAL '{NAV_REFRESH_OVERLAP}'
+                          )
+
+                        UNION ALL
+
+                        SELECT nav_date, deleted_at
+                        FROM nav_tombstones
+                        WHERE fund = :fund
+                          AND CAST(:since AS TIMESTAMPTZ) IS NOT NULL
+                          AND deleted_at > CAST(:since AS TIMESTAMPTZ)
+                              - INTERVAL '{NAV_REFRESH_OVERLAP}'
+                    ) s
+                    GROUP BY nav_date
+                )
+                SELECT
+                    t.nav_date AS touched_date,
+                    t.stamp,
+                    n.nav_date,
+                    n.nav_total,
+                    n.current_units,
+                    n.nav_per_unit
+                FROM touched t
+                LEFT JOIN nav n
+                  ON n.fund = :fund
+                 AND n.nav_date = t.nav_date
+                ORDER BY t.nav_date
+            """),
+            conn,
+            params={"fund": self.fund, "since": since}
         )
 
-    return df
+    def _merge(self, delta):
+        touched = pd.to_datetime(delta["touched_date"]).to_numpy().astype("datetime64[D]")
+        rows = delta[delta["nav_date"].notna()]
+        new_dates = pd.to_datetime(rows["nav_date"]).to_numpy().astype("datetime64[D]")
+
+        # các ngày bị đụng được thay toàn bộ bằng bản mới (hoặc bỏ nếu đã xoá)
+        keep = ~np.isin(self.dates, touched)
+
+        dates = np.concatenate([self.dates[keep], new_dates])
+        order = np.argsort(dates, kind="stable")
+
+        self.dates = dates[order]
+        for c in NAV_COLUMNS:
+            self.values[c] = np.concatenate([
+                self.values[c][keep],
+                rows[c].astype(float).to_numpy()
+            ])[order]
+
+        seen = delta["stamp"].max()
+        if self.seen_at is None or seen > self.seen_at:
+            self.seen_at = seen
+
+    def refresh(self, engine) -> int:
+        """
+        Cập nhật cache theo các ngày đã ghi / xoá; trả về số dòng delta.
+        1 query mỗi lần gọi.
+        """
+        with self._lock:
+            with engine.connect() as conn:
+                delta = self._read_delta(conn, self.seen_at)
+
+            if not delta.empty:
+                self._merge(delta)
+
+            return len(delta)
+
+    def frame(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame({
+                "nav_date": pd.to_datetime(self.dates),
+                **{c: self.values[c].copy() for c in NAV_COLUMNS},
+            })
+
+
+@st.cache_resource
+def get_nav_cache(fund: str = DEFAULT_FUND) -> NavSeriesCache:
+    return NavSeriesCache(fund)
+
+
+def get_nav_df(fund: str = DEFAULT_FUND):
+    """
+    Dùng cho UI: nav table, chart (của 1 quỹ). 1 query delta mỗi lần gọi.
+    """
+    cache = get_nav_cache(fund)
+    cache.refresh(get_engine())
+
+    return cache.frame()
 def cash_df():
     """
     Dùng cho UI: cash chart
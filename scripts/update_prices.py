@@ -0,0 +1,217 @@
+"""
+Headless price refresh daemon.
+
+    python -m scripts.update_prices            # chạy theo lịch phiên HOSE
+    python -m scripts.update_prices --once     # chạy 1 lần rồi thoát
+    python -m scripts.update_prices --backfill # kèm backfill price_history
+
+Chạy update_all_prices sau mỗi phiên đóng cửa (+ delay), rồi bảo trì
+snapshot (scripts.snapshots); có file lock để chỉ 1 instance chạy. UI chỉ
+đọc giá đã refresh và trạng thái lần chạy cuối trong STATUS_PATH; muốn
+refresh ngoài lịch thì UI xếp 1 yêu cầu vào REQUEST_PATH, daemon chạy nó
+ở lần kiểm tra kế tiếp (REQUEST_POLL).
+
+Lịch chạy theo ngày giao dịch HOSE (scripts.quote_cache.is_trading_day):
+T7, CN, lễ cố định và các ngày trong HOSE_HOLIDAYS không chạy.
+"""
+import argparse
+import datetime
+import fcntl
+import json
+import os
+import time
+
+from scripts.quote_cache import HOSE_TZ, next_session_close
+
+# ==============================
+# CONFIG
+# ==============================
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ".cache"
+)
+LOCK_PATH = os.getenv("UPDATE_PRICES_LOCK", os.path.join(CACHE_DIR, "update_prices.lock"))
+STATUS_PATH = os.getenv("UPDATE_PRICES_STATUS", os.path.join(CACHE_DIR, "update_prices.json"))
+REQUEST_PATH = os.getenv("UPDATE_PRICES_REQUEST", os.path.join(CACHE_DIR, "update_prices.request"))
+
+# giây; daemon kiểm tra yêu cầu refresh từ UI trong lúc chờ lịch
+REQUEST_POLL = 15
+
+# chờ Yahoo có nến ngày sau ATC
+CLOSE_DELAY = datetime.timedelta(minutes=20)
+
+
+# ==============================
+# 1️⃣ LOCK (1 INSTANCE)
+# ==============================
+def acquire_lock(path: str = LOCK_PATH):
+    """
+    flock không chặn; trả về file handle (giữ mở suốt đời process)
+    hoặc None nếu instance khác đang chạy.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    handle = open(path, "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+
+    handle.write(str(os.getpid()))
+    handle.flush()
+    return handle
+
+
+# ==============================
+# 2️⃣ STATUS (UI ĐỌC)
+# ==============================
+def write_status(status: dict, path: str = STATUS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f, default=str)
+    os.replace(tmp, path)
+
+
+def read_status(path: str = STATUS_PATH) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# ==============================
+# 2️⃣b YÊU CẦU REFRESH (UI XẾP, DAEMON CHẠY)
+# ==============================
+def request_refresh(backfill: bool = False, path: str = REQUEST_PATH) -> dict:
+    """
+    Xếp 1 yêu cầu refresh cho daemon (không gọi provider trong request
+    của UI). Yêu cầu chưa chạy được gộp: backfill giữ nếu đã có.
+    """
+    pending = read_request(path) or {}
+
+    request = {
+        "requested_at": datetime.datetime.now(HOSE_TZ).isoformat(),
+        "backfill": bool(backfill or pending.get("backfill")),
+    }
+    write_status(request, path)
+    return request
+
+
+def read_request(path: str = REQUEST_PATH) -> dict | None:
+    return read_status(path)
+
+
+def take_request(path: str = REQUEST_PATH) -> dict | None:
+    """
+    Lấy và xoá yêu cầu đang chờ (chỉ daemon gọi, trong file lock).
+    """
+    request = read_request(path)
+
+    if request is not None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    return request
+
+
+# ==============================
+# 3️⃣ RUN
+# ==============================
+def run_once(engine, backfill: bool = False) -> dict:
+    from scripts.pricing_yahoo import update_all_prices, backfill_price_history
+
+    started = datetime.datetime.now(HOSE_TZ)
+
+    status = {"started_at": started.isoformat()}
+
+    try:
+        # sau phiên đóng cửa luôn lấy giá mới, bỏ qua cache
+        refresh = update_all_prices(engine, use_cache=False)
+        status.update({
+            "succeeded": len(refresh.succeeded),
+            "cached": len(refresh.cached),
+            "failed": refresh.failed,
+            "skipped": refresh.skipped,
+            "rows": refresh.rows,
+        })
+
+        if backfill:
+            status["backfill"] = backfill_price_history(engine)
+
+        status["ok"] = True
+
+    except Exception as e:
+        status.update({"ok": False, "error": str(e)})
+
+    # bảo trì snapshot (partition tháng tới + retention), ngoài request path
+    try:
+        from scripts.snapshots import run_snapshot_maintenance
+
+        status["snapshots"] = run_snapshot_maintenance(engine)
+    except Exception as e:
+        status["snapshots"] = {"error": str(e)}
+
+    status["finished_at"] = datetime.datetime.now(HOSE_TZ).isoformat()
+    write_status(status)
+
+    print(f"[INFO] price refresh: {status}")
+    return status
+
+
+def next_run_at(now: datetime.datetime | None = None) -> datetime.datetime:
+    """
+    Lần chạy kế tiếp = phiên đóng cửa kế tiếp + CLOSE_DELAY.
+    Nếu đang trong khoảng [close, close + delay) thì chạy ngay khi hết delay.
+    """
+    if now is None:
+        now = datetime.datetime.now(HOSE_TZ)
+
+    return next_session_close(now - CLOSE_DELAY) + CLOSE_DELAY
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless price refresh")
+    parser.add_argument("--once", action="store_true", help="run one refresh and exit")
+    parser.add_argument("--backfill", action="store_true", help="also backfill price_history")
+    args = parser.parse_args(argv)
+
+    lock = acquire_lock()
+    if lock is None:
+        print("[WARN] another update_prices instance is running")
+        return 1
+
+    from scripts.db_engine import get_engine
+    engine = get_engine()
+
+    if args.once:
+        return 0 if run_once(engine, args.backfill)["ok"] else 1
+
+    while True:
+        run_at = next_run_at()
+
+        print(f"[INFO] next price refresh at {run_at.isoformat()}")
+
+        # chờ tới lịch, trong lúc chờ chạy các yêu cầu từ UI
+        while True:
+            wait_s = (run_at - datetime.datetime.now(HOSE_TZ)).total_seconds()
+            if wait_s <= 0:
+                break
+
+            time.sleep(min(wait_s, REQUEST_POLL))
+
+            request = take_request()
+            if request is not None:
+                print(f"[INFO] refresh requested at {request.get('requested_at')}")
+                run_once(engine, args.backfill or request.get("backfill", False))
+
+        run_once(engine, args.backfill)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,14 @@
+import pytest
+
+from scripts.import_budget import IMPORT_BUDGET, PAGE_MODULES, measure_import
+
+
+@pytest.mark.parametrize("module", PAGE_MODULES)
+def test_page_cold_import_within_budget(module):
+    result = measure_import(module)
+
+    assert not result["heavy"], f"{module} eagerly imports {result['heavy']}"
+    assert result["seconds"] <= IMPORT_BUDGET, (
+        f"{module} cold import took {result['seconds']:.2f}s "
+        f"> {IMPORT_BUDGET:.2f}s; slowest: {result['top']}"
+    )